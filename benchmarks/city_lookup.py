@@ -0,0 +1,74 @@
+"""Замер времени проверки города (is_valid_city) при росте списка городов: таблица в памяти, mmap и старый перебор.
+
+Запуск из корня проекта:
+    python benchmarks/city_lookup.py
+"""
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from city_index import (MappedCityTable, MemoryCityTable, compile_city_table, is_valid_city,  # noqa: E402
+                        normalize_city_name)
+from data.cities import CITIES  # noqa: E402
+
+ALPHABET = "абвгдежзиклмнопрстуфхцчшэюя"
+SIZES = [len(CITIES), 10_000, 100_000, 1_000_000]
+QUERIES = 2_000
+
+
+# Генерация списка городов нужного размера
+def make_cities(size, rng):
+    """Дополняет настоящий список случайными названиями до нужного размера"""
+    cities = list(CITIES)
+    seen = {normalize_city_name(city) for city in cities}
+    while len(cities) < size:
+        name = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(4, 12))).capitalize()
+        if name.lower() not in seen:
+            seen.add(name.lower())
+            cities.append(name)
+    return cities
+
+
+# Старая проверка полным перебором списка (для сравнения)
+def linear_is_valid_city(city, cities_list):
+    normalized_input = normalize_city_name(city)
+    for valid_city in cities_list:
+        if normalize_city_name(valid_city) == normalized_input:
+            return True, valid_city
+    return False, None
+
+
+# Среднее время одной проверки в микросекундах
+def time_per_query(table, queries):
+    total = timeit.timeit(lambda: [is_valid_city(q, table) for q in queries], number=5)
+    return total / (5 * len(queries)) * 1e6
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'городов':>10} {'память, мкс':>12} {'mmap, мкс':>10} {'перебор, мкс':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in SIZES:
+            cities = make_cities(size, rng)
+            queries = [rng.choice(cities) for _ in range(QUERIES // 2)]
+            queries += [f"Нетакого{i}" for i in range(QUERIES // 2)]
+            memory_us = time_per_query(MemoryCityTable(cities), queries)
+            path = os.path.join(tmp, f"cities_{size}.bin")
+            compile_city_table(cities, path)
+            mapped = MappedCityTable(path)
+            mapped_us = time_per_query(mapped, queries)
+            mapped.close()
+            linear_us = "-"
+            if size <= 10_000:
+                sample = queries[::100]
+                linear = timeit.timeit(lambda: [linear_is_valid_city(q, cities) for q in sample], number=1)
+                linear_us = f"{linear / len(sample) * 1e6:.1f}"
+            print(f"{size:>10} {memory_us:>12.2f} {mapped_us:>10.2f} {linear_us:>13}")
+
+
+if __name__ == "__main__":
+    main()
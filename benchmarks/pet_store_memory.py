@@ -0,0 +1,70 @@
+"""Сравнение памяти: словарь словарей (старый pets_data) и колоночное PetStore.
+
+Запуск из корня проекта:
+    python benchmarks/pet_store_memory.py            # 1 000 000 питомцев
+    python benchmarks/pet_store_memory.py 100000
+"""
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pet_store import PET_TYPES, PetStore  # noqa: E402
+
+NAMES = ["Мурзик", "Барсик", "Кеша", "Шарик", "Бобик", "Рыжик", "Пушок", "Снежок"]
+
+
+# Замер памяти, занятой результатом build()
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = random.Random(42)
+    # Имена создаются заранее и общие для обоих вариантов, чтобы сравнивать только раскладку
+    names = [rng.choice(NAMES) + str(i % 100) for i in range(count)]
+    now = time.time()
+
+    def build_dicts():
+        return {
+            str(100_000_000 + i): {
+                'name': names[i],
+                'type': PET_TYPES[i % 3],
+                'hunger': rng.randint(0, 100),
+                'mood': rng.randint(0, 100),
+                'energy': rng.randint(0, 100),
+                'last_update': datetime.fromtimestamp(now - i).isoformat()
+            }
+            for i in range(count)
+        }
+
+    def build_store():
+        store = PetStore()
+        for i in range(count):
+            store.put(100_000_000 + i, names[i], PET_TYPES[i % 3], rng.randint(0, 100),
+                      rng.randint(0, 100), rng.randint(0, 100), now - i)
+        return store
+
+    dicts, dicts_size, dicts_time = measure(build_dicts)
+    del dicts
+    store, store_size, store_time = measure(build_store)
+    print(f"питомцев: {count}")
+    print(f"словарь словарей: {dicts_size / 2**20:8.1f} МБ ({dicts_size / count:6.0f} Б/питомец), {dicts_time:.1f} с")
+    print(f"PetStore:         {store_size / 2**20:8.1f} МБ ({store_size / count:6.0f} Б/питомец), {store_time:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
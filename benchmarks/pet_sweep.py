@@ -0,0 +1,37 @@
+"""Замер полного прохода убывания и поиска голодных/грустных/уставших питомцев (PetStore.find_needs).
+
+Запуск из корня проекта:
+    python benchmarks/pet_sweep.py            # 1 000 000 питомцев
+    python benchmarks/pet_sweep.py 100000
+"""
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pet_store  # noqa: E402
+from pet_store import PET_TYPES, PetStore  # noqa: E402
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = random.Random(42)
+    now = time.time()
+    store = PetStore()
+    for i in range(count):
+        store.put(100_000_000 + i, "Мурзик", PET_TYPES[i % 3], rng.randint(0, 100),
+                  rng.randint(0, 100), rng.randint(0, 100), now - rng.randint(0, 48 * 3600))
+    print(f"питомцев: {count}, numpy: {'да' if pet_store.np is not None else 'нет'}")
+    needs = store.find_needs(now)
+    for stat, user_ids in needs.items():
+        print(f"  {stat} < {pet_store.NEED_THRESHOLD}: {len(user_ids)}")
+    runs = 10 if pet_store.np is not None else 1
+    elapsed = timeit.timeit(lambda: store.find_needs(now), number=runs) / runs
+    print(f"полный проход: {elapsed * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Стресс-проверка блокировок по пользователю: тысячи одновременных нажатий одного пользователя через диспетчер бота.
+
+Нажатия «Покормить», «Поиграть» и «Спать» одного питомца отправляются в dp.feed_update одновременно,
+запросы к Telegram подменяются заглушкой. Запись питомца откладывается до ответа на нажатие, так что
+между чтением и записью обработчик отдаёт управление циклу событий, как при асинхронном сохранении.
+Без блокировки пользователя записи затирают друг друга. С блокировкой нажатия проходят по очереди
+в порядке поступления: итог совпадает с последовательным применением тех же действий,
+а реестр блокировок после прогона пуст.
+
+Запуск из корня проекта:
+    python benchmarks/user_lock_stress.py
+"""
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Настройки бота читаются при импорте: тестовый токен, отдельная папка данных,
+# без ограничения частоты нажатий и отправки сообщений
+os.environ.setdefault("BOT_TOKEN", "123:abc")
+os.environ["DATA_ROOT"] = tempfile.mkdtemp(prefix="user_lock_stress_")
+os.environ["THROTTLE_CALLBACK_RATE"] = os.environ["THROTTLE_CALLBACK_BURST"] = "1000000"
+os.environ["SEND_GLOBAL_RATE"] = os.environ["SEND_CHAT_RATE"] = "1000000"
+
+import bot  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+
+UPDATES = 5000
+USER_ID = 42
+
+
+# Отложенная запись питомца
+class DeferredSaves:
+    """Подменяет чтение и запись питомца в боте: запись выполняется при следующем запросе к Telegram
+    и считается затёртой, если после чтения питомца его уже кто-то сохранил"""
+
+    def __init__(self, frozen):
+        self.frozen = frozen
+        self.current_pet = bot.get_current_pet
+        self.save_pet = bot.save_pet
+        self.version = 0
+        self.lost = 0
+        # Задача каждого апдейта видит своё значение: версия при чтении и ожидающая запись
+        self._read_version = contextvars.ContextVar("read_version", default=0)
+        self._pending = contextvars.ContextVar("pending_save", default=None)
+
+    def install(self):
+        bot.get_current_pet = self.get_current_pet
+        bot.save_pet = self.defer_save
+
+    def get_current_pet(self, user_id, now=None):
+        # Время остановлено на моменте создания: иначе характеристики чуть убывают за прогон,
+        # и энергия 15 становится 14.99 - игра отклоняется, хотя по порядку действий должна пройти
+        self._read_version.set(self.version)
+        return self.current_pet(user_id, self.frozen)
+
+    def defer_save(self, user_id, pet):
+        self._pending.set((user_id, pet, self._read_version.get()))
+
+    def complete(self):
+        pending = self._pending.get()
+        if pending is None:
+            return
+        self._pending.set(None)
+        user_id, pet, read_version = pending
+        if read_version != self.version:
+            self.lost += 1
+        self.save_pet(user_id, pet)
+        self.version += 1
+
+
+# Реестр блокировок, который ничего не блокирует (контрольный прогон)
+class NoLocks:
+    def __len__(self):
+        return 0
+
+    def __call__(self, key):
+        return contextlib.nullcontext()
+
+
+saves = None
+
+
+async def fake_request(session_bot, method, timeout=None):
+    await asyncio.sleep(0)
+    saves.complete()
+    if isinstance(method, SendMessage):
+        return Message(message_id=1, date=int(time.time()), chat=Chat(id=method.chat_id, type="private"),
+                       text=method.text)
+    return True
+
+
+def callback_update(update_id, data):
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "stress",
+            "data": data,
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": USER_ID, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                "text": "Меню"
+            }
+        }
+    })
+
+
+# Те же действия, что в pet_action, применённые по очереди
+def apply_sequentially(stats, actions):
+    hunger, mood, energy = stats
+    for action in actions:
+        if action == "action_feed":
+            hunger = min(100, hunger + 30)
+            mood = min(100, mood + 10)
+        elif action == "action_play":
+            if energy >= 15:
+                mood = min(100, mood + 25)
+                energy = max(0, energy - 15)
+                hunger = max(0, hunger - 10)
+        else:
+            energy = min(100, energy + 40)
+            mood = min(100, mood + 5)
+            hunger = max(0, hunger - 10)
+    return hunger, mood, energy
+
+
+async def run(actions, first_update_id):
+    """Создаёт питомца заново, одновременно отправляет нажатия; возвращает итог, число затёртых записей и время"""
+    bot.create_pet(USER_ID, "Мурзик", "cat")
+    saves.version = saves.lost = 0
+    updates = [callback_update(update_id, data) for update_id, data in enumerate(actions, first_update_id)]
+    started = time.perf_counter()
+    await asyncio.gather(*(bot.dp.feed_update(bot.bot, update) for update in updates))
+    elapsed = time.perf_counter() - started
+    row = bot.pets_data.row(USER_ID)
+    return (bot.pets_data.hunger[row], bot.pets_data.mood[row], bot.pets_data.energy[row]), saves.lost, elapsed
+
+
+async def main():
+    global saves
+    bot.bot.session.make_request = fake_request
+    bot.create_pet(USER_ID, "Мурзик", "cat")
+    saves = DeferredSaves(bot.pets_data.updated[bot.pets_data.row(USER_ID)])
+    saves.install()
+    # Голод и энергия то растут, то падают до нуля, поэтому итог зависит от порядка обработки
+    actions = random.choices(("action_feed", "action_play", "action_sleep"), weights=(1, 4, 1), k=UPDATES)
+    expected = apply_sequentially((100, 100, 100), actions)
+
+    locks = bot.user_locks.locks
+    for name, registry in (("без блокировок", NoLocks()), ("с блокировками", locks)):
+        bot.user_locks.locks = registry
+        # Новые id апдейтов и нажатий, иначе фильтр повторов отбросит второй прогон
+        first_update_id = 1 if registry is locks else UPDATES + 1
+        final, lost, elapsed = await run(actions, first_update_id)
+        print(f"{name}: {UPDATES} нажатий за {elapsed:.2f} с ({UPDATES / elapsed:.0f}/с), "
+              f"затёрто записей: {lost}, итог (голод, настроение, энергия): {final}")
+        if registry is locks:
+            assert lost == 0, "записи затёрты несмотря на блокировки"
+            assert final == expected, "итог не совпадает с последовательным применением действий"
+            assert len(locks) == 0, "после завершения в реестре остались блокировки"
+        else:
+            assert lost > 0, "без блокировок записи не затираются - проверка ничего не доказывает"
+    print(f"ожидалось: {expected}")
+    print("✅ без блокировок записи теряются, с блокировками все нажатия применены по очереди, реестр пуст")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""Прогон записанных апдейтов через вебхук бота: POST на сервер и время ответа.
+
+Бот запускается в режиме вебхука без регистрации в Telegram (WEBHOOK_URL не задан),
+скрипт отправляет апдейты так же, как их прислал бы Telegram, с заголовком секрета.
+Апдейты берутся из файла JSONL (по одному апдейту Bot API в строке) или генерируются.
+Ответы самого бота уйдут в Telegram и с тестовым токеном завершатся ошибкой - это ожидаемо,
+проверяются быстрые ответы 200 и отказ запросам с чужим секретом.
+
+Запуск из корня проекта:
+    BOT_MODE=webhook WEBHOOK_SECRET=test BOT_TOKEN=123:abc python bot.py
+    python benchmarks/webhook_replay.py http://127.0.0.1:8080/webhook --secret test [--file updates.jsonl]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import aiohttp
+
+TEXTS = ("/start", "📊 Статус", "🗣️ Поговорить", "🤔 Филосовские вопросы", "🏙️ Играть в города", "Москва")
+
+
+def generate_updates(count, users):
+    now = int(time.time())
+    for update_id in range(1, count + 1):
+        user_id = random.randrange(1, users + 1)
+        yield {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": now,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+                "text": random.choice(TEXTS)
+            }
+        }
+
+
+def read_updates(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def post(session, url, secret, update, latencies, statuses):
+    started = time.perf_counter()
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+    async with session.post(url, json=update, headers=headers) as response:
+        await response.read()
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    latencies.append(time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--file", help="JSONL с записанными апдейтами")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    updates = read_updates(args.file) if args.file else list(generate_updates(args.count, args.users))
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(session, update):
+        async with semaphore:
+            await post(session, args.url, args.secret, update, latencies, statuses)
+
+    async with aiohttp.ClientSession() as session:
+        # Запрос с чужим секретом сервер должен отклонить
+        async with session.post(args.url, json={"update_id": 0},
+                                headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+            rejected = response.status
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(session, update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"апдейтов: {len(updates)} за {elapsed:.2f} с ({len(updates) / elapsed:.0f}/с), ответы: {statuses}")
+    print(f"время ответа: p50 {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс, макс {latencies[-1] * 1000:.1f} мс")
+    print(f"чужой секрет: {rejected}")
+    assert rejected == 401, "запрос с чужим секретом не отклонён"
+    assert statuses == {200: len(updates)}, "не все апдейты приняты"
+    print("✅ все апдейты приняты")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
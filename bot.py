@@ -1,19 +1,34 @@
 import asyncio
-import json
 import os
 import random
-import re
+import secrets
 import time
-from datetime import datetime
+import tracemalloc
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 # Импортируем данные из отдельных файлов
-from data.debates import DEBATES
 from data.cities import CITIES
+from data.debates import DEBATES
 from data.pet_phrases import PET_PHRASES
+from fsm_storage import TTLMemoryStorage
+from city_index import (get_last_letter, get_first_letter, lookup_city_id, find_city_starting_with,
+                        used_to_json, used_from_json, UsedCities, CityCandidates, CITY_TABLE)
+from diagnostics import SamplingProfiler, AllocationDiff, memory_report, format_size
+from metrics import Metrics
+from middlewares import (DedupMiddleware, ThrottleMiddleware, UserLockMiddleware, ConcurrencyLimitMiddleware,
+                         UpdateMetricsMiddleware, HandlerMetricsMiddleware, TraceMiddleware)
+from notifications import NeedScheduler
+from pet_store import PetStore, PET_TYPES, DECAY_PER_HOUR, NEED_THRESHOLD
+from send_queue import SendQueue, mark_background
+from storage import JsonStorage, SqliteStorage, WriteBehind, migrate
+import tracing
 
 # Инициализация бота
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -21,142 +36,240 @@ if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения!")
 
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
-
+# Состояния диалога (ввод имени питомца, игра в города) живут в памяти; неизменённые FSM_TTL_HOURS часов забываются
+FSM_TTL_HOURS = float(os.getenv("FSM_TTL_HOURS", "24"))
+dp = Dispatcher(storage=TTLMemoryStorage(ttl=FSM_TTL_HOURS * 3600))
+# Метрики (время обработчиков, работа с хранилищем, очереди) отдаются на METRICS_PORT, если он задан
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT")
+metrics = Metrics()
+# Каждый апдейт трассируется целиком, включая ожидание в очередях
+dp.update.outer_middleware(TraceMiddleware())
+dp.update.outer_middleware(UpdateMetricsMiddleware(metrics))
+handler_metrics = HandlerMetricsMiddleware(metrics)
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+# Повторно доставленные апдейты и нажатия отбрасываются до всех остальных проверок
+dedup = DedupMiddleware()
+dp.update.outer_middleware(dedup)
+# Частые нажатия и сообщения одного пользователя отсекаются до очереди пользователя (в секунду / запас)
+THROTTLE_CALLBACK_RATE = float(os.getenv("THROTTLE_CALLBACK_RATE", "2"))
+THROTTLE_CALLBACK_BURST = int(os.getenv("THROTTLE_CALLBACK_BURST", "5"))
+THROTTLE_TEXT_RATE = float(os.getenv("THROTTLE_TEXT_RATE", "1"))
+THROTTLE_TEXT_BURST = int(os.getenv("THROTTLE_TEXT_BURST", "5"))
+throttle = ThrottleMiddleware(THROTTLE_CALLBACK_RATE, THROTTLE_CALLBACK_BURST, THROTTLE_TEXT_RATE, THROTTLE_TEXT_BURST)
+dp.update.outer_middleware(throttle)
+# Апдейты одного пользователя обрабатываются по очереди, разных - параллельно
+user_locks = UserLockMiddleware()
+dp.update.outer_middleware(user_locks)
+# Не больше MAX_CONCURRENT_UPDATES апдейтов в обработке одновременно; ожидание своей очереди
+# у пользователя слот не занимает, поэтому ограничение стоит после блокировки пользователя
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "100"))
+update_limit = ConcurrencyLimitMiddleware(MAX_CONCURRENT_UPDATES)
+dp.update.outer_middleware(update_limit)
+
+# Все исходящие сообщения идут через общую очередь с лимитами Telegram (сообщений в секунду)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+send_queue = SendQueue(global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE)
+bot.session.middleware(send_queue)
+
+# Папка с данными; у каждого воркера кластера своя
+DATA_ROOT = os.getenv("DATA_ROOT", ".")
 # Файлы для сохранения данных
-DATA_FILE = "pets_data.json"
+DATA_FILE = os.path.join(DATA_ROOT, "pets_data.json")
+DATA_DIR = os.path.join(DATA_ROOT, "pets_data")
 DEBATES_FILE = "debates.json"
-CITIES_GAME_FILE = "cities_game_data.json"
+CITIES_GAME_FILE = os.path.join(DATA_ROOT, "cities_game_data.json")
+CITIES_GAME_DIR = os.path.join(DATA_ROOT, "cities_game_data")
+CITIES_ARCHIVE_DIR = os.path.join(DATA_ROOT, "cities_game_archive")
+SQLITE_FILE = os.getenv("SQLITE_FILE", os.path.join(DATA_ROOT, "tamagotchi.db"))
+# Апдейты и фоновые записи дольше TRACE_SLOW_MS миллисекунд пишутся с разбивкой по участкам в SLOW_LOG_FILE;
+# ожидание в очереди отправки не считается: его задают лимиты Telegram, а не код бота
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+SLOW_LOG_FILE = os.getenv("SLOW_LOG_FILE", os.path.join(DATA_ROOT, "slow_updates.jsonl"))
+SLOW_LOG_MAX_MB = float(os.getenv("SLOW_LOG_MAX_MB", "10"))
+tracing.configure(SLOW_LOG_FILE, TRACE_SLOW_MS, max_bytes=int(SLOW_LOG_MAX_MB * 1024 * 1024))
+# Администраторы (id через запятую): им доступны команды диагностики
+ADMIN_IDS = frozenset(int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip())
+# Папка для файлов профайлера
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(DATA_ROOT, "profiles"))
+# Раз в MEMORY_LOG_INTERVAL секунд в консоль пишется строка о памяти подсистем (0 - не писать)
+MEMORY_LOG_INTERVAL = float(os.getenv("MEMORY_LOG_INTERVAL", "3600"))
+# MEMORY_TRACE=1 включает tracemalloc для поиска утечек (бот работает заметно медленнее)
+if os.getenv("MEMORY_TRACE") == "1":
+    tracemalloc.start()
+# Задержка записи на диск в секундах: изменения за это время сохраняются одной пачкой
+SAVE_INTERVAL = float(os.getenv("SAVE_INTERVAL", "0.5"))
+# Через сколько часов без ходов игра в города считается брошенной
+CITIES_GAME_TTL_HOURS = float(os.getenv("CITIES_GAME_TTL_HOURS", "24"))
+# Как часто (в секундах) завершённые и брошенные игры переносятся в архив
+CITIES_GC_INTERVAL = float(os.getenv("CITIES_GC_INTERVAL", "600"))
+
+# Тип хранилища: "json" (по умолчанию, для небольших установок) или "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+PETS = "pets"
+CITIES_GAMES = "cities_games"
+CITIES_ARCHIVE = "cities_archive"
+
+# Режим получения апдейтов: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес бота (https://example.com); если задан, бот сам регистрирует вебхук в Telegram
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token; без него вебхук, зарегистрированный ботом, получает случайный
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or (secrets.token_urlsafe(32) if WEBHOOK_URL else None)
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise ValueError("WEBHOOK_SECRET не найден в переменных окружения! Без него вебхук принимает апдейты от кого угодно")
+
+# Создание JSON хранилища (старые pets_data.json и cities_game_data.json переносятся при первом запуске)
+def open_json_storage():
+    """Открывает JSON хранилище: шарды + журнал изменений"""
+    return JsonStorage(
+        {PETS: DATA_DIR, CITIES_GAMES: CITIES_GAME_DIR, CITIES_ARCHIVE: CITIES_ARCHIVE_DIR},
+        legacy_files={PETS: DATA_FILE, CITIES_GAMES: CITIES_GAME_FILE}
+    )
+
+# Создание хранилища по настройкам
+def open_storage():
+    """Открывает выбранное хранилище; новая SQLite база один раз заполняется из JSON файлов"""
+    if STORAGE_BACKEND == "json":
+        return open_json_storage()
+    if STORAGE_BACKEND == "sqlite":
+        fresh = not os.path.exists(SQLITE_FILE)
+        os.makedirs(os.path.dirname(SQLITE_FILE) or ".", exist_ok=True)
+        sqlite_storage = SqliteStorage(SQLITE_FILE, [PETS, CITIES_GAMES, CITIES_ARCHIVE])
+        if fresh:
+            json_storage = open_json_storage()
+            migrate(json_storage, sqlite_storage, [PETS, CITIES_GAMES, CITIES_ARCHIVE])
+            json_storage.close()
+        return sqlite_storage
+    raise ValueError(f"Неизвестный тип хранилища: {STORAGE_BACKEND}")
+
+storage = open_storage()
+# Игра в памяти хранит использованные города отсортированным массивом id, на диске - списком чисел
+def cities_game_to_record(game):
+    """Возвращает копию игры для записи на диск"""
+    if game is None:
+        return None
+    record = dict(game)
+    record['cities_used'] = used_to_json(game['cities_used'])
+    return record
+
+# Игра из записи на диске
+def cities_game_from_record(record):
+    """Восстанавливает игру из записи; игры под старую таблицу городов завершаются (id в них уже другие)"""
+    game = dict(record)
+    if game.get('cities_table') != CITY_TABLE.fingerprint and not all(
+            isinstance(value, str) for value in game['cities_used']):
+        game['active'] = False
+        game.setdefault('end_time', game.get('last_move', game['start_time']))
+        game['cities_used'] = UsedCities()
+    else:
+        game['cities_used'] = used_from_json(game['cities_used'])
+    game['cities_table'] = CITY_TABLE.fingerprint
+    return game
+
+# Запись на диск идёт в фоне, обработчики только отмечают изменённые записи
+persistence = WriteBehind(storage, SAVE_INTERVAL, snapshots={CITIES_GAMES: cities_game_to_record})
 
 # Загрузка данных из файла
+@metrics.timed("storage_call_seconds", "Время вызовов загрузки и сохранения данных")
 def load_data():
-    """Загружает данные питомцев из JSON файла"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+    """Загружает питомцев из хранилища в колоночное хранилище в памяти"""
+    records = storage.load(PETS)
+    # Старые временные записи temp_<id> больше не хранятся вместе с питомцами
+    for key in records:
+        if not key.isdigit():
+            persistence.mark(PETS, key, None)
+    return PetStore.from_records(records)
 
 # Сохранение данных в файл
-def save_data(data):
-    """Сохраняет данные питомцев в JSON файл"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+@metrics.timed("storage_call_seconds", "Время вызовов загрузки и сохранения данных")
+def save_data(data, *keys):
+    """Отмечает изменённые ключи питомцев для фоновой записи (без ключей - все данные)"""
+    for key in (keys or list(data)):
+        persistence.mark(PETS, key, data.get(str(key)))
 
 # Загрузка данных игры в города
+@metrics.timed("storage_call_seconds", "Время вызовов загрузки и сохранения данных")
 def load_cities_game_data():
-    """Загружает данные игры в города из JSON файла"""
-    if os.path.exists(CITIES_GAME_FILE):
-        try:
-            with open(CITIES_GAME_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+    """Загружает данные всех игр в города из хранилища"""
+    return {user_id: cities_game_from_record(record)
+            for user_id, record in storage.load(CITIES_GAMES).items()}
 
 # Сохранение данных игры в города
-def save_cities_game_data(data):
-    """Сохраняет данные игры в города в JSON файл"""
-    with open(CITIES_GAME_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-# Нормализация названия города
-def normalize_city_name(city):
-    """Нормализует название города (убирает лишние символы, приводит к нижнему регистру)"""
-    normalized = re.sub(r'[^\w\s-]', '', city.strip().lower())
-    normalized = normalized.replace('ё', 'е')
-    return normalized
-
-# Получение последней буквы для игры
-def get_last_letter(city):
-    """Получает последнюю букву города для игры (обрабатывает исключения)"""
-    city = city.strip().lower().replace('ё', 'е')
-    if not city:
-        return None
-    excluded_letters = {'ь', 'ъ', 'ы'}
-    for i in range(len(city) - 1, -1, -1):
-        letter = city[i]
-        if letter.isalpha() and letter not in excluded_letters:
-            return letter
-    return None
-
-# Получение первой буквы города
-def get_first_letter(city):
-    """Получает первую букву города"""
-    city = city.strip().lower().replace('ё', 'е')
-    if city and city[0].isalpha():
-        return city[0]
-    return None
-
-# Проверка города в списке
-def is_valid_city(city, cities_list):
-    """Проверяет, есть ли город в списке"""
-    normalized_input = normalize_city_name(city)
-    for valid_city in cities_list:
-        if normalize_city_name(valid_city) == normalized_input:
-            return True, valid_city
-    return False, None
-
-# Поиск города на букву
-def find_city_starting_with(letter, cities_list, used_cities):
-    """Находит город, начинающийся на указанную букву"""
-    available_cities = []
-    for city in cities_list:
-        if (get_first_letter(city) == letter and
-                normalize_city_name(city) not in used_cities):
-            available_cities.append(city)
-    if available_cities:
-        return random.choice(available_cities)
-    return None
+@metrics.timed("storage_call_seconds", "Время вызовов загрузки и сохранения данных")
+def save_cities_game_data(data, *keys):
+    """Отмечает изменённые игры в города для фоновой записи (без ключей - все данные)"""
+    for key in (keys or list(data)):
+        persistence.mark(CITIES_GAMES, key, data.get(str(key)))
+
+# Получение игры пользователя
+def get_cities_game(user_id):
+    """Возвращает игру в города пользователя из памяти или None"""
+    return cities_game_data.get(str(user_id))
+
+# Кандидаты для ответов бота в игре (в памяти, после перезапуска создаются заново)
+def get_city_candidates(user_id):
+    """Возвращает оставшихся кандидатов для ответов бота в игре пользователя"""
+    candidates = cities_candidates.get(str(user_id))
+    if candidates is None:
+        candidates = cities_candidates[str(user_id)] = CityCandidates()
+    return candidates
 
 # Инициализация игры в города
 def start_cities_game(user_id):
     """Начинает новую игру в города"""
-    first_city = random.choice(CITIES)
+    first_city_id = random.randrange(len(CITY_TABLE))
+    first_city = CITY_TABLE.name(first_city_id)
     game_data = {
         str(user_id): {
             'active': True,
-            'cities_used': [normalize_city_name(first_city)],
+            'cities_used': UsedCities((first_city_id,)),
+            'cities_table': CITY_TABLE.fingerprint,
             'last_city': first_city,
             'last_letter': get_last_letter(first_city),
             'score': 0,
-            'start_time': time.time()
+            'start_time': time.time(),
+            'last_move': time.time()
         }
     }
-    cities_game_data = load_cities_game_data()
     cities_game_data.update(game_data)
-    save_cities_game_data(cities_game_data)
+    cities_candidates[str(user_id)] = CityCandidates()
+    save_cities_game_data(cities_game_data, user_id)
     return True, first_city
 
 # Обработка хода игрока
 def process_player_move(user_id, city):
     """Обрабатывает ход игрока в игре городов"""
-    cities_game_data = load_cities_game_data()
-    if str(user_id) not in cities_game_data or not cities_game_data[str(user_id)]['active']:
+    game = get_cities_game(user_id)
+    if not game or not game['active']:
         return False, "Игра не активна!"
-    game = cities_game_data[str(user_id)]
-    is_valid, correct_city_name = is_valid_city(city, CITIES)
-    if not is_valid:
+    city_id = lookup_city_id(city)
+    if city_id is None:
         return False, f"Город '{city}' не найден в списке!"
-    normalized_city = normalize_city_name(correct_city_name)
-    if normalized_city in game['cities_used']:
+    correct_city_name = CITY_TABLE.name(city_id)
+    if city_id in game['cities_used']:
         return False, f"Город '{correct_city_name}' уже был назван!"
     required_letter = game['last_letter']
     first_letter = get_first_letter(correct_city_name)
     if first_letter != required_letter:
         return False, f"Город должен начинаться на букву '{required_letter.upper()}'!"
-    game['cities_used'].append(normalized_city)
+    game['cities_used'].add(city_id)
+    game['last_move'] = time.time()
     game['last_city'] = correct_city_name
     game['last_letter'] = get_last_letter(correct_city_name)
     game['score'] += 1
-    bot_city = find_city_starting_with(game['last_letter'], CITIES, game['cities_used'])
-    if bot_city:
-        game['cities_used'].append(normalize_city_name(bot_city))
+    bot_city_id = find_city_starting_with(game['last_letter'], game['cities_used'], get_city_candidates(user_id))
+    if bot_city_id is not None:
+        bot_city = CITY_TABLE.name(bot_city_id)
+        game['cities_used'].add(bot_city_id)
         game['last_city'] = bot_city
         game['last_letter'] = get_last_letter(bot_city)
-        save_cities_game_data(cities_game_data)
+        save_cities_game_data(cities_game_data, user_id)
         return True, {
             'player_city': correct_city_name,
             'bot_city': bot_city,
@@ -164,10 +277,12 @@ def process_player_move(user_id, city):
             'score': game['score']
         }
     else:
-        game_time = time.time() - game['start_time']
+        game['end_time'] = time.time()
+        game_time = game['end_time'] - game['start_time']
         final_score = game['score']
         game['active'] = False
-        save_cities_game_data(cities_game_data)
+        cities_candidates.pop(str(user_id), None)
+        save_cities_game_data(cities_game_data, user_id)
         return True, {
             'player_city': correct_city_name,
             'game_won': True,
@@ -178,27 +293,70 @@ def process_player_move(user_id, city):
 # Завершение игры
 def end_cities_game(user_id):
     """Завершает игру в города"""
-    cities_game_data = load_cities_game_data()
-    if str(user_id) not in cities_game_data:
+    game = get_cities_game(user_id)
+    if not game:
         return False, 0, 0
-    game = cities_game_data[str(user_id)]
     if not game['active']:
         return False, 0, 0
-    game_time = time.time() - game['start_time']
+    game['end_time'] = time.time()
+    game_time = game['end_time'] - game['start_time']
     final_score = game['score']
     game['active'] = False
-    save_cities_game_data(cities_game_data)
+    cities_candidates.pop(str(user_id), None)
+    save_cities_game_data(cities_game_data, user_id)
     return True, final_score, game_time
 
 # Проверка активной игры
 def is_cities_game_active(user_id):
     """Проверяет, активна ли игра в города у пользователя"""
-    cities_game_data = load_cities_game_data()
-    return (str(user_id) in cities_game_data and
-            cities_game_data[str(user_id)].get('active', False))
+    game = get_cities_game(user_id)
+    return bool(game and game.get('active', False))
+
+# Перенос завершённых и брошенных игр в архив
+def collect_cities_games(now=None):
+    """Переносит завершённые и брошенные игры в архив (только счёт, длительность и время), возвращает их число"""
+    now = now or time.time()
+    expire_before = now - CITIES_GAME_TTL_HOURS * 3600
+    archived = {}
+    for user_id, game in list(cities_game_data.items()):
+        last_move = game.get('last_move', game['start_time'])
+        if game.get('active') and last_move >= expire_before:
+            continue
+        end_time = game.get('end_time', last_move)
+        archived[f"{user_id}:{int(game['start_time'])}"] = {
+            'user_id': user_id,
+            'score': game['score'],
+            'duration': end_time - game['start_time'],
+            'start_time': game['start_time'],
+            'end_time': end_time,
+            'abandoned': bool(game.get('active'))
+        }
+        del cities_game_data[user_id]
+        cities_candidates.pop(user_id, None)
+        save_cities_game_data(cities_game_data, user_id)
+    for key, record in archived.items():
+        persistence.mark(CITIES_ARCHIVE, key, record)
+    return len(archived)
+
+# Периодическая уборка игр в города
+async def cities_games_gc_loop():
+    """Раз в CITIES_GC_INTERVAL секунд переносит старые игры в архив"""
+    while True:
+        collect_cities_games()
+        await asyncio.sleep(CITIES_GC_INTERVAL)
 
 # Глобальные переменные для хранения данных
 pets_data = load_data()
+# Игры в города держим в памяти, на диск в фоне уходят только изменённые игры
+cities_game_data = load_cities_game_data()
+cities_candidates = {}
+
+# Состояния диалога с пользователем
+class PetCreation(StatesGroup):
+    awaiting_name = State()
+
+class CitiesGame(StatesGroup):
+    playing = State()
 
 # Создание обычной клавиатуры
 def get_keyboard():
@@ -244,60 +402,63 @@ def get_actions_keyboard():
     )
     return keyboard
 
-# Обновление характеристик питомца по времени
-def update_pet_stats(user_id):
-    """Обновляет характеристики питомца в зависимости от прошедшего времени"""
-    if str(user_id) not in pets_data:
-        return
-    pet = pets_data[str(user_id)]
-    now = datetime.now()
-    last_update = datetime.fromisoformat(pet['last_update'])
-    hours_passed = (now - last_update).total_seconds() / 3600
-    decrease = int(hours_passed * 2)
-    if decrease > 0:
-        pet['hunger'] = max(0, pet['hunger'] - decrease)
-        pet['mood'] = max(0, pet['mood'] - decrease)
-        pet['energy'] = max(0, pet['energy'] - decrease)
-        pet['last_update'] = now.isoformat()
-        save_data(pets_data)
+# Текущие характеристики питомца по времени
+def get_current_pet(user_id, now=None):
+    """Возвращает питомца с характеристиками на текущий момент (ничего не сохраняет)"""
+    row = pets_data.row(user_id)
+    if row is None:
+        return None
+    now = now or time.time()
+    decrease = max(0.0, (now - pets_data.updated[row]) / 3600 * DECAY_PER_HOUR)
+    return {
+        'name': pets_data.names[row],
+        'type': PET_TYPES[pets_data.types[row]],
+        'hunger': max(0, pets_data.hunger[row] - decrease),
+        'mood': max(0, pets_data.mood[row] - decrease),
+        'energy': max(0, pets_data.energy[row] - decrease),
+        'last_update': now
+    }
+
+# Сохранение изменённого питомца
+def save_pet(user_id, pet):
+    """Сохраняет питомца: его текущие характеристики становятся новой точкой отсчёта убывания"""
+    pets_data.put(user_id, pet['name'], pet['type'], pet['hunger'], pet['mood'], pet['energy'],
+                  pet['last_update'])
+    save_data(pets_data, user_id)
+    need_scheduler.schedule(user_id)
 
 # Создание нового питомца
 def create_pet(user_id, name, pet_type):
     """Создает нового питомца для пользователя"""
-    pets_data[str(user_id)] = {
-        'name': name,
-        'type': pet_type,
-        'hunger': 100,
-        'mood': 100,
-        'energy': 100,
-        'last_update': datetime.now().isoformat()
-    }
-    save_data(pets_data)
+    pets_data.put(user_id, name, pet_type, 100, 100, 100, time.time())
+    save_data(pets_data, user_id)
+    need_scheduler.schedule(user_id)
 
 # Получение статуса питомца
 def get_pet_status(user_id):
     """Возвращает строку со статусом питомца"""
-    if str(user_id) not in pets_data:
+    pet = get_current_pet(user_id)
+    if pet is None:
         return None
-    update_pet_stats(user_id)
-    pet = pets_data[str(user_id)]
     emoji_map = {'cat': '🐱', 'dog': '🐶', 'parrot': '🦜'}
     pet_emoji = emoji_map.get(pet['type'], '🐱')
+    # Проверки идут по тем же округлённым значениям, что показаны в полосках
+    hunger, mood, energy = round(pet['hunger']), round(pet['mood']), round(pet['energy'])
     def make_bar(value):
         filled = '█' * (value // 10)
         empty = '░' * (10 - value // 10)
         return f"[{filled}{empty}] {value}%"
     status = f"{pet_emoji} {pet['name']}\n\n"
-    status += f"🍖 Голод: {make_bar(pet['hunger'])}\n"
-    status += f"😊 Настроение: {make_bar(pet['mood'])}\n"
-    status += f"⚡ Энергия: {make_bar(pet['energy'])}\n\n"
-    if pet['hunger'] < 20:
+    status += f"🍖 Голод: {make_bar(hunger)}\n"
+    status += f"😊 Настроение: {make_bar(mood)}\n"
+    status += f"⚡ Энергия: {make_bar(energy)}\n\n"
+    if hunger < NEED_THRESHOLD:
         status += "😫 Я очень голоден!"
-    elif pet['mood'] < 20:
+    elif mood < NEED_THRESHOLD:
         status += "😢 Мне грустно..."
-    elif pet['energy'] < 20:
+    elif energy < NEED_THRESHOLD:
         status += "😴 Я очень устал..."
-    elif pet['hunger'] > 80 and pet['mood'] > 80 and pet['energy'] > 80:
+    elif hunger > 80 and mood > 80 and energy > 80:
         if pet['type'] == 'cat':
             status += "😻 Мяу! Я счастлив!"
         elif pet['type'] == 'dog':
@@ -316,6 +477,22 @@ def get_random_phrase(pet_type, action="talk"):
         if phrases_list:
             return random.choice(phrases_list)
 
+# Напоминание о нуждах питомца
+async def notify_pet_need(user_id, stat):
+    """Отправляет хозяину фразу питомца о том, чего ему не хватает"""
+    pet = get_current_pet(user_id)
+    if pet is None:
+        return
+    mark_background()
+    action = {'hunger': 'hungry', 'mood': 'sad', 'energy': 'tired'}[stat]
+    emoji_map = {'cat': '🐱', 'dog': '🐶', 'parrot': '🦜'}
+    pet_emoji = emoji_map.get(pet['type'], '🐱')
+    phrase = get_random_phrase(pet['type'], action)
+    await bot.send_message(user_id, f"{pet_emoji} {pet['name']}: {phrase}", reply_markup=get_actions_keyboard())
+
+# Планировщик напоминаний: одна куча и одна задача на всех питомцев
+need_scheduler = NeedScheduler(pets_data, notify_pet_need)
+
 # Получение случайного вопроса для "филосовских вопросов"
 def get_random_debate():
     """Возвращает случайный вопрос для 'филосовских вопросов'"""
@@ -334,9 +511,98 @@ async def start_command(message: types.Message):
         reply_markup=get_pet_type_keyboard()
     )
 
+# Профилирование работающего бота
+async def run_profiler(message, seconds):
+    """Снимает стеки цикла событий seconds секунд, сохраняет свёрнутые стеки и присылает самые горячие функции"""
+    profiler = SamplingProfiler()
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    path = os.path.join(PROFILE_DIR, f"profile_{int(time.time())}.folded")
+    await asyncio.to_thread(profiler.write_collapsed, path)
+    samples = profiler.samples or 1
+    lines = [f"🔥 Профиль за {seconds} с: {profiler.samples} семплов\n",
+             "собственное время / со вложенными - функция"]
+    for label, own, total in profiler.top(15):
+        lines.append(f"{own * 100 / samples:5.1f}% / {total * 100 / samples:5.1f}% - {label}")
+    await message.answer("\n".join(lines))
+    await message.answer_document(FSInputFile(path), caption="Свёрнутые стеки для flamegraph.pl / speedscope")
+
+# Запущенное профилирование (одновременно только одно)
+profiler_task = None
+
+# Обработчик команды /profile (только для администраторов)
+@dp.message(Command("profile"), F.from_user.id.in_(ADMIN_IDS))
+async def profile_command(message: types.Message, command: CommandObject):
+    global profiler_task
+    if profiler_task is not None and not profiler_task.done():
+        await message.answer("Профилирование уже идёт ⏳")
+        return
+    try:
+        seconds = min(max(int(command.args or 10), 1), 300)
+    except ValueError:
+        await message.answer("Использование: /profile [секунд]")
+        return
+    await message.answer(f"⏱ Профилирую {seconds} с...")
+    # Профилируем в отдельной задаче, чтобы не держать очередь апдейтов администратора
+    profiler_task = asyncio.create_task(run_profiler(message, seconds))
+
+# Подсистемы для отчёта о памяти
+def memory_subsystems():
+    """Возвращает {название: (объект, число записей)}; общие объекты засчитываются первой подсистеме в списке"""
+    return {
+        "таблица городов": (CITY_TABLE, len(CITY_TABLE)),
+        "список CITIES": (CITIES, len(CITIES)),
+        "питомцы": (pets_data, len(pets_data)),
+        "состояния диалогов": (dp.storage, dp.storage.count()),
+        "игры в города": (cities_game_data, len(cities_game_data)),
+        "кандидаты ходов бота": (cities_candidates, len(cities_candidates)),
+        "напоминания": (need_scheduler, len(need_scheduler)),
+        "защита от флуда": (throttle, len(throttle.callbacks) + len(throttle.texts)),
+        "повторы апдейтов": (dedup, len(dedup.seen)),
+        "очередь отправки": (send_queue, send_queue.stats()['queue_depth']),
+        "запись на диск": (persistence, None),
+    }
+
+# Отчёт о памяти
+async def build_memory_report(allocations, limit=10):
+    """Считает размеры подсистем и рост памяти по tracemalloc в отдельном потоке, возвращает строки отчёта"""
+    rows = await asyncio.to_thread(memory_report, memory_subsystems())
+    growth = await asyncio.to_thread(allocations.diff, limit)
+    lines = [f"{name}: {format_size(size)}" + (f" ({count} шт.)" if count is not None else "")
+             for name, count, size in rows]
+    if growth is None:
+        lines.append("tracemalloc выключен (MEMORY_TRACE=1)")
+    elif not growth:
+        lines.append("Первый снимок tracemalloc сохранён, рост будет виден в следующем отчёте")
+    else:
+        lines.append("Рост с прошлого снимка:")
+        lines.extend(f"+{format_size(size)} (+{count} блоков) - {where}" for where, size, count in growth)
+    return lines
+
+# Снимки tracemalloc для команды /memory и для периодической строки в консоли
+memory_command_allocations = AllocationDiff()
+memory_log_allocations = AllocationDiff()
+
+# Обработчик команды /memory (только для администраторов)
+@dp.message(Command("memory"), F.from_user.id.in_(ADMIN_IDS))
+async def memory_command(message: types.Message):
+    lines = await build_memory_report(memory_command_allocations)
+    await message.answer("🧠 Память по подсистемам:\n\n" + "\n".join(lines))
+
+# Периодическая строка о памяти
+async def memory_log_loop():
+    """Раз в MEMORY_LOG_INTERVAL секунд пишет в консоль размеры подсистем и рост памяти"""
+    while True:
+        await asyncio.sleep(MEMORY_LOG_INTERVAL)
+        lines = await build_memory_report(memory_log_allocations, limit=3)
+        print("🧠 Память: " + "; ".join(lines))
+
 # Обработчик выбора типа питомца
 @dp.callback_query(F.data.startswith("type_"))
-async def choose_pet_type(callback: types.CallbackQuery):
+async def choose_pet_type(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     if str(user_id) in pets_data:
         await callback.answer("У вас уже есть питомец!")
@@ -347,8 +613,8 @@ async def choose_pet_type(callback: types.CallbackQuery):
         f"Отлично! Вы выбрали {type_names[pet_type]} 🎉\n\n"
         f"Теперь введите имя для питомца:"
     )
-    pets_data[f"temp_{user_id}"] = pet_type
-    save_data(pets_data)
+    await state.set_state(PetCreation.awaiting_name)
+    await state.update_data(pet_type=pet_type)
 
 # Обработчик действий с питомцем
 @dp.callback_query(F.data.startswith("action_"))
@@ -358,8 +624,7 @@ async def pet_action(callback: types.CallbackQuery):
     if str(user_id) not in pets_data:
         await callback.answer("У вас нет питомца!")
         return
-    update_pet_stats(user_id)
-    pet = pets_data[str(user_id)]
+    pet = get_current_pet(user_id)
     emoji_map = {'cat': '🐱', 'dog': '🐶', 'parrot': '🦜'}
     pet_emoji = emoji_map.get(pet['type'], '🐱')
     if action == "feed":
@@ -369,7 +634,9 @@ async def pet_action(callback: types.CallbackQuery):
         response = f"{pet_emoji} {pet['name']}: {phrase}"
     elif action == "play":
         if pet['energy'] < 15:
-            response = f"{pet_emoji} {pet['name']}: Я слишком устал для игр... 😴"
+            await callback.answer()
+            await callback.message.answer(f"{pet_emoji} {pet['name']}: Я слишком устал для игр... 😴")
+            return
         else:
             pet['mood'] = min(100, pet['mood'] + 25)
             pet['energy'] = max(0, pet['energy'] - 15)
@@ -382,8 +649,7 @@ async def pet_action(callback: types.CallbackQuery):
         pet['hunger'] = max(0, pet['hunger'] - 10)
         phrase = get_random_phrase(pet['type'], 'sleep')
         response = f"{pet_emoji} {pet['name']}: {phrase}"
-    pet['last_update'] = datetime.now().isoformat()
-    save_data(pets_data)
+    save_pet(user_id, pet)
     await callback.answer()
     await callback.message.answer(response)
 
@@ -394,8 +660,7 @@ async def talk_to_pet(message: types.Message):
     if str(user_id) not in pets_data:
         await message.answer("У вас нет питомца! Используйте /start")
         return
-    update_pet_stats(user_id)
-    pet = pets_data[str(user_id)]
+    pet = get_current_pet(user_id)
     emoji_map = {'cat': '🐱', 'dog': '🐶', 'parrot': '🦜'}
     pet_emoji = emoji_map.get(pet['type'], '🐱')
     if pet['energy'] < 10:
@@ -412,8 +677,7 @@ async def talk_to_pet(message: types.Message):
     phrase = get_random_phrase(pet['type'], 'talk')
     emoji_map = {'cat': '🐱', 'dog': '🐶', 'parrot': '🦜'}
     pet_emoji = emoji_map.get(pet['type'], '🐱')
-    pet['last_update'] = datetime.now().isoformat()
-    save_data(pets_data)
+    save_pet(user_id, pet)
     await message.answer(f"{pet_emoji} {pet['name']}: {phrase}")
 
 # Обработчик кнопки "Филосовские вопросы"
@@ -423,8 +687,7 @@ async def absurd_debates(message: types.Message):
     if str(user_id) not in pets_data:
         await message.answer("У вас нет питомца! Используйте /start")
         return
-    update_pet_stats(user_id)
-    pet = pets_data[str(user_id)]
+    pet = get_current_pet(user_id)
     emoji_map = {'cat': '🐱', 'dog': '🐶', 'parrot': '🦜'}
     pet_emoji = emoji_map.get(pet['type'], '🐱')
     if pet['energy'] < 10:
@@ -439,8 +702,7 @@ async def absurd_debates(message: types.Message):
     pet['mood'] = min(100, pet['mood'] + 12)
     pet['hunger'] = max(0, pet['hunger'] - 10)
     debate_question = get_random_debate()
-    pet['last_update'] = datetime.now().isoformat()
-    save_data(pets_data)
+    save_pet(user_id, pet)
     await message.answer(
         f"{pet_emoji} {pet['name']} предлагает обсудить:\n\n"
         f"🤔 {debate_question}\n\n"
@@ -448,12 +710,12 @@ async def absurd_debates(message: types.Message):
 
 # Обработчик кнопки "Играть в города"
 @dp.message(F.text == "🏙️ Играть в города")
-async def start_cities_game_handler(message: types.Message):
+async def start_cities_game_handler(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     if str(user_id) not in pets_data:
         await message.answer("У вас нет питомца! Используйте /start")
         return
-    pet = pets_data[str(user_id)]
+    pet = get_current_pet(user_id)
     emoji_map = {'cat': '🐱', 'dog': '🐶', 'parrot': '🦜'}
     pet_emoji = emoji_map.get(pet['type'], '🐱')
     if pet['energy'] < 10:
@@ -465,6 +727,7 @@ async def start_cities_game_handler(message: types.Message):
         await message.answer(response)
         return
     if is_cities_game_active(user_id):
+        await state.set_state(CitiesGame.playing)
         await message.answer(
             "У вас уже есть активная игра в города! 🏙️\n"
             "Завершите текущую игру или назовите город.",
@@ -475,6 +738,7 @@ async def start_cities_game_handler(message: types.Message):
     if not success:
         await message.answer(f"Ошибка при запуске игры: {result}")
         return
+    await state.set_state(CitiesGame.playing)
     await message.answer(
         f"🏙️ **Игра в города началась!**\n\n"
         f"🤖 Я начинаю: **{result}**\n\n"
@@ -490,8 +754,10 @@ async def start_cities_game_handler(message: types.Message):
 
 # Обработчик завершения игры в города
 @dp.message(F.text == "🚪 Закончить игру")
-async def end_cities_game_handler(message: types.Message):
+async def end_cities_game_handler(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
+    if await state.get_state() == CitiesGame.playing:
+        await state.clear()
     if not is_cities_game_active(user_id):
         await message.answer(
             "У вас нет активной игры в города! 🤷‍♂️",
@@ -533,83 +799,186 @@ async def new_pet(message: types.Message):
     user_id = message.from_user.id
     if str(user_id) in pets_data:
         del pets_data[str(user_id)]
-        save_data(pets_data)
+        save_data(pets_data, user_id)
+        need_scheduler.cancel(user_id)
     await message.answer(
         "Создадим нового питомца! 🎉\n\n"
         "Выберите тип питомца:",
         reply_markup=get_pet_type_keyboard()
     )
 
-# Обработчик ввода текста
-@dp.message(F.text)
-async def handle_text_messages(message: types.Message):
+# Обработчик хода в игре в города
+@dp.message(CitiesGame.playing, F.text)
+async def cities_game_move(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     text = message.text
-    if is_cities_game_active(user_id):
+    if not is_cities_game_active(user_id):
+        # Игру уже завершили или убрали в архив
+        await state.clear()
+        await handle_text_messages(message, state)
+        return
+    with tracing.span("process_player_move"):
         success, result = process_player_move(user_id, text)
-        if not success:
-            await message.answer(
-                f"❌ {result}\n\nПопробуйте еще раз!",
-                reply_markup=get_cities_game_keyboard()
-            )
-            return
-        if isinstance(result, dict):
-            if result.get('game_won'):
-                minutes = int(result['game_time'] // 60)
-                seconds = int(result['game_time'] % 60)
-                await message.answer(
-                    f"🎉 **Поздравляю! Вы победили!**\n\n"
-                    f"✅ Ваш город: **{result['player_city']}**\n"
-                    f"🤖 Я не смог найти город на эту букву!\n\n"
-                    f"📊 **Итоговая статистика:**\n"
-                    f"🏆 Правильных ответов: **{result['final_score']}**\n"
-                    f"⏱ Время игры: **{minutes}м {seconds}с**\n\n"
-                    f"Отличная игра! 🥳",
-                    reply_markup=get_keyboard(),
-                    parse_mode="Markdown"
-                )
-            else:
-                await message.answer(
-                    f"✅ **{result['player_city']}** - принято!\n\n"
-                    f"🤖 Мой ход: **{result['bot_city']}**\n\n"
-                    f"🎯 Ваш ход! Назовите город на букву **'{result['next_letter'].upper()}'**\n\n"
-                    f"📊 Правильных ответов: **{result['score']}**",
-                    reply_markup=get_cities_game_keyboard(),
-                    parse_mode="Markdown"
-                )
+    if not success:
+        await message.answer(
+            f"❌ {result}\n\nПопробуйте еще раз!",
+            reply_markup=get_cities_game_keyboard()
+        )
         return
-    temp_key = f"temp_{user_id}"
-    if temp_key in pets_data:
-        pet_type = pets_data[temp_key]
-        del pets_data[temp_key]
-        if len(text) > 15:
-            await message.answer("Имя слишком длинное! Максимум 15 символов.")
-            return
-        if not text.strip():
-            await message.answer("Введите нормальное имя!")
-            return
-        create_pet(user_id, text.strip(), pet_type)
-        type_names = {"cat": "котик", "dog": "собачка", "parrot": "попуг"}
-        emoji_map = {"cat": "🐱", "dog": "🐶", "parrot": "🦜"}
+    if result.get('game_won'):
+        await state.clear()
+        minutes = int(result['game_time'] // 60)
+        seconds = int(result['game_time'] % 60)
         await message.answer(
-            f"🎉 Поздравляю! Ваш {type_names[pet_type]} {emoji_map[pet_type]} {text} создан!\n\n"
-            f"Все показатели: 100% ✨\n\n"
-            f"💡 Совет: Разные действия по-разному влияют на статы:\n"
-            f"🍖 Кормление - восстанавливает голод\n"
-            f"🎮 Игра - поднимает настроение, но тратит энергию\n"
-            f"💤 Сон - восстанавливает энергию\n"
-            f"🗣️ Общение и 'фиолосовские вопросы' тоже влияют на питомца!",
-            reply_markup=get_keyboard()
+            f"🎉 **Поздравляю! Вы победили!**\n\n"
+            f"✅ Ваш город: **{result['player_city']}**\n"
+            f"🤖 Я не смог найти город на эту букву!\n\n"
+            f"📊 **Итоговая статистика:**\n"
+            f"🏆 Правильных ответов: **{result['final_score']}**\n"
+            f"⏱ Время игры: **{minutes}м {seconds}с**\n\n"
+            f"Отличная игра! 🥳",
+            reply_markup=get_keyboard(),
+            parse_mode="Markdown"
         )
     else:
-        await message.answer("Не понимаю 🤔\nИспользуйте кнопки или создайте питомца командой /start")
+        await message.answer(
+            f"✅ **{result['player_city']}** - принято!\n\n"
+            f"🤖 Мой ход: **{result['bot_city']}**\n\n"
+            f"🎯 Ваш ход! Назовите город на букву **'{result['next_letter'].upper()}'**\n\n"
+            f"📊 Правильных ответов: **{result['score']}**",
+            reply_markup=get_cities_game_keyboard(),
+            parse_mode="Markdown"
+        )
+
+# Обработчик ввода имени питомца
+@dp.message(PetCreation.awaiting_name, F.text)
+async def pet_name_entered(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    text = message.text
+    if len(text) > 15:
+        await message.answer("Имя слишком длинное! Максимум 15 символов.")
+        return
+    if not text.strip():
+        await message.answer("Введите нормальное имя!")
+        return
+    pet_type = (await state.get_data()).get('pet_type', PET_TYPES[0])
+    await state.clear()
+    create_pet(user_id, text.strip(), pet_type)
+    type_names = {"cat": "котик", "dog": "собачка", "parrot": "попуг"}
+    emoji_map = {"cat": "🐱", "dog": "🐶", "parrot": "🦜"}
+    await message.answer(
+        f"🎉 Поздравляю! Ваш {type_names[pet_type]} {emoji_map[pet_type]} {text} создан!\n\n"
+        f"Все показатели: 100% ✨\n\n"
+        f"💡 Совет: Разные действия по-разному влияют на статы:\n"
+        f"🍖 Кормление - восстанавливает голод\n"
+        f"🎮 Игра - поднимает настроение, но тратит энергию\n"
+        f"💤 Сон - восстанавливает энергию\n"
+        f"🗣️ Общение и 'фиолосовские вопросы' тоже влияют на питомца!",
+        reply_markup=get_keyboard()
+    )
+
+# Обработчик остального текста
+@dp.message(StateFilter(None), F.text)
+async def handle_text_messages(message: types.Message, state: FSMContext):
+    # Состояния в памяти теряются при перезапуске, а игры в города - нет: возвращаем игрока в игру
+    if is_cities_game_active(message.from_user.id):
+        await state.set_state(CitiesGame.playing)
+        await cities_game_move(message, state)
+        return
+    await message.answer("Не понимаю 🤔\nИспользуйте кнопки или создайте питомца командой /start")
+
+# Значения, которые снимаются при каждом запросе метрик
+metrics.collect("updates_processing", lambda: update_limit.in_flight, help="Апдейты в обработчиках")
+metrics.collect("updates_duplicate_total", lambda: dedup.duplicates, "counter", "Отброшенные повторы апдейтов")
+metrics.collect("updates_throttled_total", lambda: throttle.throttled, "counter", "Апдейты, отсечённые защитой от флуда")
+metrics.collect("send_queue_depth", lambda: send_queue.stats()['queue_depth'], help="Сообщения, ждущие отправки")
+metrics.collect("send_queue_sent_total", lambda: send_queue.sent, "counter", "Отправленные сообщения")
+metrics.collect("send_queue_retries_total", lambda: send_queue.retries, "counter", "Повторы после 429")
+metrics.collect("send_queue_wait_seconds_total", lambda: send_queue.total_wait, "counter",
+                "Суммарное ожидание слота отправки")
+metrics.collect("storage_bytes_written_total", lambda: storage.bytes_written, "counter", "Байты, записанные хранилищем")
+metrics.collect("storage_flushes_total", lambda: persistence.flushes, "counter", "Фоновые записи на диск")
+metrics.collect("storage_records_written_total", lambda: persistence.records_written, "counter",
+                "Записи, сохранённые фоновой записью")
+metrics.collect("storage_flush_seconds_total", lambda: persistence.flush_seconds, "counter",
+                "Время фоновой записи на диск")
+metrics.collect("pets", lambda: len(pets_data), help="Питомцы в памяти")
+metrics.collect("cities_games_active", lambda: sum(1 for game in cities_game_data.values() if game.get('active')),
+                help="Активные игры в города")
+metrics.collect("notifications_scheduled", lambda: len(need_scheduler), help="Запланированные напоминания")
+
+# Задачи переноса старых игр в архив и строки о памяти, сервер метрик (создаются при запуске)
+gc_task = None
+memory_log_task = None
+metrics_runner = None
+
+# Запуск фоновых задач
+@dp.startup()
+async def on_startup():
+    """Запускает фоновую запись, напоминания, сборку старых игр, строку о памяти и сервер метрик"""
+    global gc_task, memory_log_task, metrics_runner
+    persistence.start()
+    need_scheduler.schedule_all()
+    need_scheduler.start()
+    gc_task = asyncio.create_task(cities_games_gc_loop())
+    if MEMORY_LOG_INTERVAL > 0:
+        memory_log_task = asyncio.create_task(memory_log_loop())
+    if METRICS_PORT:
+        metrics_runner = await metrics.serve(METRICS_HOST, int(METRICS_PORT))
+        print(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+# Остановка фоновых задач
+@dp.shutdown()
+async def on_shutdown():
+    """Останавливает фоновые задачи и дописывает изменения на диск"""
+    if gc_task is not None:
+        gc_task.cancel()
+    if memory_log_task is not None:
+        memory_log_task.cancel()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await need_scheduler.close()
+    await persistence.close()
+    await asyncio.to_thread(tracing.close)
+    print(f"📤 Очередь отправки: {send_queue.stats()}")
+    storage.close()
+
+# Приём апдейтов через вебхук
+async def run_webhook():
+    """Поднимает aiohttp сервер: Telegram сразу получает 200, апдейт обрабатывается в фоне"""
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=True,
+                         secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    # Запуск и остановка приложения вызывают startup/shutdown диспетчера
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        print(f"🌐 Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                  allowed_updates=dp.resolve_used_update_types())
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 # Запуск бота
 async def main():
     print("🚀 Бот запущен!")
-    print(f"📁 Данные сохраняются в: {DATA_FILE}")
-    print(f"🎮 Данные игры в города сохраняются в: {CITIES_GAME_FILE}")
-    await dp.start_polling(bot)
+    if STORAGE_BACKEND == "sqlite":
+        print(f"📁 Данные сохраняются в SQLite: {SQLITE_FILE}")
+    else:
+        print(f"📁 Данные сохраняются в: {DATA_DIR}/")
+        print(f"🎮 Данные игры в города сохраняются в: {CITIES_GAME_DIR}/")
+    if BOT_MODE == "webhook":
+        await run_webhook()
+    elif BOT_MODE == "polling":
+        # Оставшийся от режима webhook вебхук мешает getUpdates
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    else:
+        raise ValueError(f"Неизвестный режим работы бота: {BOT_MODE}")
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""Сборка бинарной таблицы городов для игры в города.
+
+Пример:
+    python build_city_table.py names.txt cities.bin
+    python build_city_table.py geonames_ru.tsv cities.bin --column 3
+
+Во входном файле одна строка - один город (для TSV можно выбрать столбец).
+Без входного файла (`-`) собирается встроенный список из data/cities.py.
+Бот подхватывает файл из CITY_TABLE_FILE (по умолчанию cities.bin) при запуске.
+"""
+import argparse
+import time
+
+from city_index import compile_city_table
+from data.cities import CITIES
+
+
+# Чтение названий из текстового файла
+def read_names(path, column):
+    """Читает названия городов из файла: по одному в строке или из столбца TSV"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if column < len(fields) and fields[column].strip():
+                yield fields[column].strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Собирает бинарную таблицу городов")
+    parser.add_argument("source", help="файл с названиями городов или '-' для встроенного списка")
+    parser.add_argument("output", help="куда записать таблицу (например, cities.bin)")
+    parser.add_argument("--column", type=int, default=0, help="номер столбца TSV с названием (с нуля)")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    names = CITIES if args.source == "-" else read_names(args.source, args.column)
+    count = compile_city_table(names, args.output)
+    print(f"✅ {args.output}: {count} городов за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
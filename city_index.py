@@ -0,0 +1,313 @@
+import bisect
+import mmap
+import os
+import random
+import re
+import struct
+import zlib
+from array import array
+
+from data.cities import CITIES
+from tracing import span
+
+_NON_NAME_CHARS = re.compile(r'[^\w\s-]')
+
+
+# Нормализация названия города
+def normalize_city_name(city):
+    """Нормализует название города (убирает лишние символы, приводит к нижнему регистру)"""
+    normalized = _NON_NAME_CHARS.sub('', city.strip().lower())
+    normalized = normalized.replace('ё', 'е')
+    return normalized
+
+
+# Получение последней буквы для игры
+def get_last_letter(city):
+    """Получает последнюю букву города для игры (обрабатывает исключения)"""
+    city = city.strip().lower().replace('ё', 'е')
+    if not city:
+        return None
+    excluded_letters = {'ь', 'ъ', 'ы'}
+    for i in range(len(city) - 1, -1, -1):
+        letter = city[i]
+        if letter.isalpha() and letter not in excluded_letters:
+            return letter
+    return None
+
+
+# Получение первой буквы города
+def get_first_letter(city):
+    """Получает первую букву города"""
+    city = city.strip().lower().replace('ё', 'е')
+    if city and city[0].isalpha():
+        return city[0]
+    return None
+
+
+# Файл с собранной таблицей городов (если его нет, используется список из data/cities.py)
+CITY_TABLE_FILE = os.getenv("CITY_TABLE_FILE", "cities.bin")
+
+# Формат файла таблицы: заголовок, диапазоны по первой букве, смещения записей, записи
+TABLE_MAGIC = b"CITYTBL1"
+_HEADER = struct.Struct("<8sIII")
+_LETTER = struct.Struct("<4sII")
+_OFFSET = struct.Struct("<I")
+
+
+# Построение таблицы городов
+def build_city_table(cities):
+    """Возвращает пары (нормализованное, каноническое название), отсортированные по нормализованному; номер пары - id города"""
+    unique = {}
+    for city in cities:
+        normalized = normalize_city_name(city)
+        if normalized:
+            unique.setdefault(normalized, city)
+    return sorted(unique.items())
+
+
+# Построение индекса по первой букве
+def build_letter_index(normalized_names):
+    """Строит словарь: первая буква -> диапазон id (начало, конец) городов на эту букву"""
+    letters = {}
+    for city_id, normalized in enumerate(normalized_names):
+        letter = normalized[0]
+        if letter.isalpha():
+            start, _ = letters.get(letter, (city_id, city_id))
+            letters[letter] = (start, city_id + 1)
+    return letters
+
+
+# Отпечаток таблицы: меняется, если меняется список городов (и значит id)
+def table_fingerprint(names):
+    """Возвращает контрольную сумму таблицы городов"""
+    return zlib.crc32("\n".join(names).encode('utf-8'))
+
+
+# Таблица городов в памяти
+class MemoryCityTable:
+    """Таблица городов из списка Python: словарь для поиска и диапазоны по первой букве"""
+
+    def __init__(self, cities):
+        entries = build_city_table(cities)
+        self._names = [city for _, city in entries]
+        self._index = {normalized: city_id for city_id, (normalized, _) in enumerate(entries)}
+        self._letters = build_letter_index([normalized for normalized, _ in entries])
+        self.fingerprint = table_fingerprint(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def name(self, city_id):
+        """Возвращает каноническое название города по id"""
+        return self._names[city_id]
+
+    def lookup(self, normalized):
+        """Возвращает id города по нормализованному названию или None"""
+        return self._index.get(normalized)
+
+    def letter_range(self, letter):
+        """Возвращает диапазон id (начало, конец) городов на букву или None"""
+        return self._letters.get(letter)
+
+
+# Таблица городов из файла, отображённого в память
+class MappedCityTable:
+    """Таблица городов из собранного файла: данные читаются с диска лениво, поиск - двоичный в диапазоне буквы"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, letter_count, self.fingerprint = _HEADER.unpack_from(self._mm, 0)
+        if magic != TABLE_MAGIC:
+            raise ValueError(f"{path}: это не файл таблицы городов")
+        self._letters = {}
+        pos = _HEADER.size
+        for _ in range(letter_count):
+            letter, start, end = _LETTER.unpack_from(self._mm, pos)
+            self._letters[letter.rstrip(b"\0").decode('utf-8')] = (start, end)
+            pos += _LETTER.size
+        self._offsets_pos = pos
+        self._blob_pos = pos + (self._count + 1) * _OFFSET.size
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, city_id):
+        pos = self._offsets_pos + city_id * _OFFSET.size
+        start = _OFFSET.unpack_from(self._mm, pos)[0]
+        end = _OFFSET.unpack_from(self._mm, pos + _OFFSET.size)[0]
+        return self._mm[self._blob_pos + start:self._blob_pos + end]
+
+    def name(self, city_id):
+        """Возвращает каноническое название города по id"""
+        return self._entry(city_id).split(b"\0", 1)[1].decode('utf-8')
+
+    def lookup(self, normalized):
+        """Возвращает id города по нормализованному названию или None"""
+        if not normalized:
+            return None
+        key = normalized.encode('utf-8')
+        lo, hi = self._letters.get(normalized[0], (0, self._count))
+        # Байтовый порядок UTF-8 совпадает с порядком сортировки строк Python
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self._entry(mid).split(b"\0", 1)[0]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def letter_range(self, letter):
+        """Возвращает диапазон id (начало, конец) городов на букву или None"""
+        return self._letters.get(letter)
+
+    def close(self):
+        self._mm.close()
+
+
+# Сборка файла таблицы городов
+def compile_city_table(cities, path):
+    """Собирает отсортированную бинарную таблицу городов с индексом по первой букве и записывает её в path"""
+    entries = build_city_table(cities)
+    letters = build_letter_index([normalized for normalized, _ in entries])
+    blob = bytearray()
+    offsets = [0]
+    for normalized, city in entries:
+        blob += normalized.encode('utf-8') + b"\0" + city.encode('utf-8')
+        offsets.append(len(blob))
+    fingerprint = table_fingerprint([city for _, city in entries])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(TABLE_MAGIC, len(entries), len(letters), fingerprint))
+        for letter, (start, end) in sorted(letters.items()):
+            f.write(_LETTER.pack(letter.encode('utf-8'), start, end))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(blob)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+# Загрузка таблицы городов
+def load_city_table(path=CITY_TABLE_FILE):
+    """Открывает собранный файл таблицы, если он есть, иначе строит таблицу из списка CITIES"""
+    if path and os.path.exists(path):
+        return MappedCityTable(path)
+    return MemoryCityTable(CITIES)
+
+
+# Таблица строится (или отображается в память) один раз при импорте
+CITY_TABLE = load_city_table()
+
+
+# Поиск id города
+def lookup_city_id(city, table=CITY_TABLE):
+    """Возвращает id города по названию или None"""
+    with span("normalize_city_name"):
+        normalized = normalize_city_name(city)
+    with span("city_lookup"):
+        return table.lookup(normalized)
+
+
+# Проверка города в списке
+def is_valid_city(city, table=CITY_TABLE):
+    """Проверяет, есть ли город в таблице"""
+    city_id = lookup_city_id(city, table)
+    if city_id is None:
+        return False, None
+    return True, table.name(city_id)
+
+
+# Использованные города одной игры
+class UsedCities:
+    """Отсортированный массив id (2 байта на город при таблице до 65536 городов, иначе 4): проверка бинарным поиском"""
+
+    __slots__ = ('_ids',)
+
+    def __init__(self, ids=(), table=CITY_TABLE):
+        self._ids = array('H' if len(table) <= 0x10000 else 'I', sorted(set(ids)))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, city_id):
+        index = bisect.bisect_left(self._ids, city_id)
+        return index < len(self._ids) and self._ids[index] == city_id
+
+    def add(self, city_id):
+        # Вставка сдвигает хвост массива, но в одной игре городов сотни, а не тысячи
+        index = bisect.bisect_left(self._ids, city_id)
+        if index == len(self._ids) or self._ids[index] != city_id:
+            self._ids.insert(index, city_id)
+
+
+# Использованные города для хранения на диске
+def used_to_json(used):
+    """Превращает использованные города в отсортированный список чисел"""
+    return list(used)
+
+
+# Использованные города из записи на диске
+def used_from_json(values, table=CITY_TABLE):
+    """Превращает список id в UsedCities (старые записи с названиями городов переводятся в id)"""
+    ids = []
+    for value in values:
+        if isinstance(value, int):
+            ids.append(value)
+        else:
+            city_id = table.lookup(normalize_city_name(value))
+            if city_id is not None:
+                ids.append(city_id)
+    return UsedCities(ids, table)
+
+
+# Оставшиеся кандидаты для ответов бота в одной игре
+class CityCandidates:
+    """Для каждой буквы хранит ленивую случайную перестановку диапазона id: выбор города стоит O(1)"""
+
+    def __init__(self, table=CITY_TABLE):
+        self._table = table
+        # буква -> [сколько кандидатов осталось, переставленные позиции]
+        self._remaining = {}
+
+    # Случайный ещё не выбранный кандидат на букву
+    def draw(self, letter):
+        """Возвращает id случайного города на букву и больше его не выдаёт"""
+        bounds = self._table.letter_range(letter)
+        if not bounds:
+            return None
+        start, end = bounds
+        state = self._remaining.get(letter)
+        if state is None:
+            state = self._remaining[letter] = [end - start, {}]
+        count, swaps = state
+        if count == 0:
+            return None
+        # Шаг тасования Фишера-Йетса без копирования диапазона: храним только переставленные позиции
+        i = random.randrange(count)
+        last = count - 1
+        chosen = swaps.get(i, i)
+        swaps[i] = swaps.pop(last, last)
+        state[0] = last
+        return start + chosen
+
+
+# Поиск города на букву
+def find_city_starting_with(letter, used_cities, candidates=None):
+    """Находит id случайного неиспользованного города на указанную букву"""
+    if candidates is None:
+        candidates = CityCandidates()
+    with span("city_search", letter=letter):
+        while True:
+            city_id = candidates.draw(letter)
+            if city_id is None:
+                return None
+            # Названные игроком города просто выбрасываются из кандидатов
+            if city_id not in used_cities:
+                return city_id
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import secrets
+import zlib
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Заголовок с секретом: от Telegram к фронту и от фронта к воркерам
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# Ключ маршрутизации апдейта
+def route_key(update):
+    """Возвращает id пользователя из апдейта (или id чата, если пользователя нет), иначе None"""
+    for field, event in update.items():
+        if field == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return None
+
+
+# Номер воркера для пользователя
+def worker_index(key, count):
+    """Возвращает номер воркера, которому принадлежит ключ; один пользователь - всегда один воркер"""
+    if key is None:
+        return 0
+    return zlib.crc32(str(key).encode('utf-8')) % count
+
+
+# Фронт: принимает вебхук Telegram и пересылает апдейт воркеру пользователя
+class UpdateRouter:
+    """Пересылает апдейт как есть (без разбора в объекты aiogram) воркеру, выбранному по user id"""
+
+    def __init__(self, workers, secret=None, worker_secret=None, timeout=10.0):
+        if not workers:
+            raise ValueError("Не задан ни один воркер")
+        self.workers = list(workers)
+        self.secret = secret
+        self.worker_secret = worker_secret
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.forwarded = [0] * len(self.workers)
+        self.failed = 0
+        self._session = None
+
+    # Регистрация в aiohttp приложении
+    def register(self, app, path):
+        """Добавляет обработчик вебхука и открытие/закрытие HTTP сессии к воркерам"""
+        app.router.add_post(path, self.handle)
+        app.on_startup.append(self._open)
+        app.on_cleanup.append(self._close)
+
+    async def _open(self, app):
+        self._session = aiohttp.ClientSession(timeout=self.timeout)
+
+    async def _close(self, app):
+        await self._session.close()
+
+    async def handle(self, request):
+        if self.secret and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        index = worker_index(route_key(update), len(self.workers))
+        headers = {"Content-Type": "application/json"}
+        if self.worker_secret:
+            headers[SECRET_HEADER] = self.worker_secret
+        try:
+            async with self._session.post(self.workers[index], data=body, headers=headers) as response:
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = None
+            logger.warning("Воркер %s недоступен: %s", self.workers[index], e)
+        # Не 200 - Telegram повторит доставку апдейта позже
+        if status != 200:
+            self.failed += 1
+            return web.Response(status=502)
+        self.forwarded[index] += 1
+        return web.Response(status=200)
+
+
+# Запуск фронта
+async def run_front(host, port, path, router, bot=None, webhook_url=None):
+    """Поднимает HTTP сервер фронта; если заданы бот и адрес, регистрирует вебхук в Telegram"""
+    app = web.Application()
+    router.register(app, path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        print(f"🔀 Фронт слушает {host}:{port}{path}, воркеров: {len(router.workers)}")
+        if bot is not None and webhook_url:
+            await bot.set_webhook(webhook_url.rstrip("/") + path, secret_token=router.secret)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        print(f"📨 Переслано по воркерам: {router.forwarded}, ошибок: {router.failed}")
+
+
+async def main():
+    from aiogram import Bot
+
+    workers = [url.strip() for url in os.getenv("CLUSTER_WORKERS", "").split(",") if url.strip()]
+    webhook_url = os.getenv("WEBHOOK_URL")
+    secret = os.getenv("WEBHOOK_SECRET") or (secrets.token_urlsafe(32) if webhook_url else None)
+    if not secret:
+        raise ValueError("WEBHOOK_SECRET не найден в переменных окружения! Без него фронт принимает апдейты от кого угодно")
+    worker_secret = os.getenv("CLUSTER_SECRET")
+    if not worker_secret:
+        raise ValueError("CLUSTER_SECRET не найден в переменных окружения! Без него воркеры не примут апдейты")
+    router = UpdateRouter(workers, secret=secret, worker_secret=worker_secret)
+    bot = Bot(token=os.environ["BOT_TOKEN"]) if webhook_url else None
+    try:
+        await run_front(os.getenv("WEBHOOK_HOST", "0.0.0.0"), int(os.getenv("WEBHOOK_PORT", "8080")),
+                        os.getenv("WEBHOOK_PATH", "/webhook"), router, bot, webhook_url)
+    finally:
+        if bot is not None:
+            await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
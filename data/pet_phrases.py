@@ -41,6 +41,22 @@ PET_PHRASES = {
             "Теперь полон энергии! ⚡",
             "Я спал 16 часов, это норма! 😸",
             "Сладкие сны о молочке! 🥛"
+        ],
+        "hungry": [
+            "Мяу! Миска пустая! 🥣",
+            "Хозяин, я умираю от голода! 😿",
+            "Где моя рыбка?! 🐟",
+            "Мяу-мяу-мяу! Покорми меня! 🍖"
+        ],
+        "sad": [
+            "Мне так одиноко... 😿",
+            "Никто со мной не играет... 🧶",
+            "Мяу... погладь меня, пожалуйста 😾"
+        ],
+        "tired": [
+            "Мурр... глаза слипаются... 😴",
+            "Уложи меня спать, я очень устал 💤",
+            "Даже мышей ловить нет сил... 🐭"
         ]
     },
     "dog": {
@@ -85,6 +101,21 @@ PET_PHRASES = {
             "Во сне я был волком! 🐺",
             "Сплю только одним глазом - охраняю! 👁️",
             "Самые сладкие сны о косточках! 🦴"
+        ],
+        "hungry": [
+            "Гав! Где моя косточка?! 🦴",
+            "Миска пустая, хозяин! 🥣",
+            "Я так голоден, что съем тапок! 🥿"
+        ],
+        "sad": [
+            "Ску-у-учно... пойдём гулять? 🐕",
+            "Гав... мне грустно без тебя 😢",
+            "Брось мне мячик, пожалуйста! 🎾"
+        ],
+        "tired": [
+            "Лапки не держат... 😴",
+            "Пора на лежанку! 💤",
+            "Даже хвостом вилять нет сил... 🐾"
         ]
     },
     "parrot": {
@@ -124,6 +155,21 @@ PET_PHRASES = {
             "Сплю — мозг отдыхает! 🧠",
             "Завтра запою на рассвете! 🌅",
             "Целую пёрышки! 💋"
+        ],
+        "hungry": [
+            "Дайте семечек! Срочно! 🌻",
+            "Кормушка пустая! Караул! 🚨",
+            "Чирик! Я голодный! 🌾"
+        ],
+        "sad": [
+            "Поговори со мной! 📢",
+            "Грустно сидеть на жердочке одному... 🪵",
+            "Чирик... никто не играет... 😢"
+        ],
+        "tired": [
+            "Пёрышки опустились... 😴",
+            "Накрой клетку, я спать хочу 💤",
+            "Даже петь нет сил... 🎶"
         ]
     }
 }
\ No newline at end of file
@@ -0,0 +1,161 @@
+import mmap
+import os
+import sys
+import threading
+import tracemalloc
+import types
+from array import array
+from collections import Counter
+
+
+# Подпись кадра стека: файл и функция
+def frame_label(code):
+    """Возвращает подпись функции для свёрнутых стеков: 'файл:функция'"""
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+# Семплирующий профайлер
+class SamplingProfiler:
+    """Раз в interval секунд снимает стек одного потока (цикла событий) из отдельного потока и считает одинаковые стеки"""
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        # стек (от корня к листу) -> сколько раз встретился
+        self.stacks = Counter()
+        self.samples = 0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = frame_label(code)
+        return label
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            del frame
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    # Запуск
+    def start(self):
+        """Начинает снимать стеки в фоновом потоке"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    # Остановка
+    def stop(self):
+        """Останавливает поток профайлера"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # Свёрнутые стеки
+    def collapsed(self):
+        """Возвращает стеки в свёрнутом формате (flamegraph.pl, speedscope): 'кадр;кадр;... число'"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def write_collapsed(self, path):
+        """Записывает свёрнутые стеки в файл"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+
+    # Самые горячие функции
+    def top(self, limit=10):
+        """Возвращает [(функция, собственные семплы, семплы со вложенными вызовами)] по убыванию собственных"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        return [(label, count, total[label]) for label, count in own.most_common(limit)]
+
+
+# Глубокий размер объекта
+def deep_sizeof(obj, seen=None):
+    """Возвращает размер объекта в байтах вместе со всем, на что он ссылается; объекты из seen (id) не считаются,
+    посчитанные добавляются в seen. Отображённые в память файлы считаются по размеру файла"""
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, (type, types.ModuleType)):
+            continue
+        seen.add(id(current))
+        if isinstance(current, mmap.mmap):
+            size += len(current)
+            continue
+        size += sys.getsizeof(current)
+        if isinstance(current, (str, bytes, bytearray, int, float, bool, array)) or current is None:
+            continue
+        # list() снимает копию атомарно: данные могут меняться, пока отчёт считается в другом потоке
+        if isinstance(current, dict):
+            stack.extend(item for pair in list(current.items()) for item in pair)
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(list(current))
+        if hasattr(current, '__dict__'):
+            stack.append(current.__dict__)
+        for slot in getattr(type(current), '__slots__', ()):
+            if hasattr(current, slot):
+                stack.append(getattr(current, slot))
+    return size
+
+
+# Отчёт о памяти по подсистемам
+def memory_report(subsystems):
+    """Принимает {название: (объект, число записей)}; возвращает [(название, записей, байт)] по убыванию размера.
+    Общие объекты (например, таблица городов у кандидатов) засчитываются первой подсистеме, где они встретились"""
+    seen = set()
+    rows = [(name, count, deep_sizeof(obj, seen)) for name, (obj, count) in subsystems.items()]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows
+
+
+def format_size(size):
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+# Рост памяти между снимками tracemalloc
+class AllocationDiff:
+    """Сравнивает снимок tracemalloc с предыдущим и показывает строки кода, где памяти стало больше"""
+
+    def __init__(self):
+        self._previous = None
+
+    def diff(self, limit=10):
+        """Возвращает [(строка кода, прирост в байтах, прирост числа блоков)] с прошлого вызова;
+        None, если tracemalloc не запущен, и [] при первом вызове"""
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        previous, self._previous = self._previous, snapshot
+        if previous is None:
+            return []
+        growth = [stat for stat in snapshot.compare_to(previous, 'lineno') if stat.size_diff > 0]
+        return [(f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                 stat.size_diff, stat.count_diff) for stat in growth[:limit]]
@@ -0,0 +1,60 @@
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+
+# Хранилище состояний FSM в памяти с истечением срока
+class TTLMemoryStorage(BaseStorage):
+    """Хранит состояние и данные FSM в памяти; запись, которую не меняли ttl секунд, удаляется"""
+
+    def __init__(self, ttl=24 * 3600):
+        self.ttl = ttl
+        # ключ -> [состояние, данные, срок]; записи упорядочены по сроку, самые старые в начале
+        self._records = OrderedDict()
+
+    # Число записей
+    def count(self):
+        """Возвращает число пользователей с непустым состоянием или данными"""
+        self._expire()
+        return len(self._records)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record[2] > now:
+                break
+            del self._records[key]
+
+    def _get(self, key):
+        self._expire()
+        return self._records.get(key)
+
+    def _put(self, key, state, data):
+        # Запись переезжает в конец: её срок теперь самый поздний
+        self._records.pop(key, None)
+        if state is None and not data:
+            return
+        self._records[key] = [state, data, time.monotonic() + self.ttl]
+
+    async def set_state(self, key, state=None):
+        record = self._get(key)
+        state = state.state if isinstance(state, State) else state
+        self._put(key, state, record[1] if record else {})
+
+    async def get_state(self, key):
+        record = self._get(key)
+        return record[0] if record else None
+
+    async def set_data(self, key, data):
+        record = self._get(key)
+        self._put(key, record[0] if record else None, dict(data))
+
+    async def get_data(self, key):
+        record = self._get(key)
+        return dict(record[1]) if record else {}
+
+    async def close(self):
+        self._records.clear()
@@ -0,0 +1,137 @@
+import asyncio
+import bisect
+import functools
+import time
+
+from aiohttp import web
+
+# Границы корзин гистограмм времени (в секундах)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+# Гистограмма значений
+class Histogram:
+    """Считает наблюдения по корзинам, их сумму и количество"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+# Реестр метрик
+class Metrics:
+    """Счётчики, гистограммы и значения, которые снимаются функциями в момент запроса; отдаёт их в формате Prometheus"""
+
+    def __init__(self, prefix="tamagotchi"):
+        self.prefix = prefix
+        # имя -> (тип, описание)
+        self._meta = {}
+        # имя -> {метки (кортеж пар): значение, гистограмма или функция}
+        self._series = {}
+
+    def _name(self, name, kind, help):
+        full_name = f"{self.prefix}_{name}"
+        if full_name not in self._meta:
+            self._meta[full_name] = (kind, help)
+            self._series[full_name] = {}
+        return full_name
+
+    # Увеличение счётчика
+    def inc(self, name, value=1, help="", **labels):
+        """Прибавляет value к счётчику с указанными метками"""
+        series = self._series[self._name(name, "counter", help)]
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + value
+
+    # Наблюдение для гистограммы
+    def observe(self, name, value, help="", **labels):
+        """Добавляет значение в гистограмму с указанными метками"""
+        series = self._series[self._name(name, "histogram", help)]
+        key = tuple(labels.items())
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    # Значение, которое снимается при каждом запросе
+    def collect(self, name, fn, kind="gauge", help="", **labels):
+        """Регистрирует функцию, возвращающую текущее значение метрики (gauge или counter)"""
+        self._series[self._name(name, kind, help)][tuple(labels.items())] = fn
+
+    # Замер времени вызовов функции
+    def timed(self, name, help=""):
+        """Декоратор: пишет время каждого вызова в гистограмму name с меткой function"""
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(name, time.perf_counter() - started, help, function=func.__name__)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started, help, function=func.__name__)
+            return wrapper
+        return decorator
+
+    # Текст для Prometheus
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus"""
+        lines = []
+        for name, (kind, help) in self._meta.items():
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in list(self._series[name].items()):
+                labels = dict(key)
+                if isinstance(value, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(value.buckets, value.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {value.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+                else:
+                    if callable(value):
+                        value = value()
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    # HTTP сервер с метриками
+    async def serve(self, host, port):
+        """Поднимает HTTP сервер с метриками на /metrics; возвращает runner для остановки"""
+        async def handle(request):
+            return web.Response(text=self.render(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
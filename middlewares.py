@@ -0,0 +1,262 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+
+import tracing
+
+
+# Реестр блокировок по ключу (user id)
+class KeyedLocks:
+    """Выдаёт asyncio.Lock на ключ; блокировка живёт, пока её кто-то держит или ждёт, потом удаляется"""
+
+    def __init__(self):
+        # ключ -> [блокировка, сколько задач её держат или ждут]
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    # Захват блокировки ключа
+    def __call__(self, key):
+        """Возвращает асинхронный контекстный менеджер, захватывающий блокировку ключа"""
+        return _KeyedLock(self, key)
+
+    def _acquire_entry(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry
+
+    def _release_entry(self, key, entry):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[key]
+
+
+class _KeyedLock:
+    def __init__(self, registry, key):
+        self._registry = registry
+        self._key = key
+        self._entry = None
+
+    async def __aenter__(self):
+        self._entry = self._registry._acquire_entry(self._key)
+        try:
+            await self._entry[0].acquire()
+        except BaseException:
+            self._registry._release_entry(self._key, self._entry)
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self._entry[0].release()
+        self._registry._release_entry(self._key, self._entry)
+
+
+# Последовательная обработка апдейтов одного пользователя
+class UserLockMiddleware(BaseMiddleware):
+    """Обрабатывает апдейты одного пользователя по очереди, апдейты разных пользователей - параллельно"""
+
+    def __init__(self, locks=None):
+        self.locks = locks or KeyedLocks()
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        async with self.locks(user.id):
+            return await handler(event, data)
+
+
+# Ограничение числа одновременно обрабатываемых апдейтов
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Пропускает в обработчики не больше limit апдейтов одновременно, остальные ждут своей очереди"""
+
+    def __init__(self, limit=100):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+
+    async def __call__(self, handler, event, data):
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.in_flight -= 1
+
+
+# Недавно встреченные ключи
+class RecentKeys:
+    """Помнит ключи не дольше ttl секунд и не больше maxsize штук; самые старые забываются первыми"""
+
+    def __init__(self, maxsize=10000, ttl=600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # ключ -> когда встретился; порядок - по времени, самые старые в начале
+        self._seen = OrderedDict()
+
+    def __len__(self):
+        return len(self._seen)
+
+    # Добавление ключа
+    def add(self, key):
+        """Запоминает ключ; возвращает False, если он уже встречался"""
+        now = time.monotonic()
+        while self._seen:
+            oldest, seen_at = next(iter(self._seen.items()))
+            if seen_at > now - self.ttl and len(self._seen) < self.maxsize:
+                break
+            del self._seen[oldest]
+        if key in self._seen:
+            return False
+        self._seen[key] = now
+        return True
+
+
+# Отбрасывание повторно доставленных апдейтов
+class DedupMiddleware(BaseMiddleware):
+    """Пропускает апдейт (и нажатие кнопки) в обработчики только один раз; повторы подтверждаются без обработки"""
+
+    def __init__(self, maxsize=10000, ttl=600.0):
+        self.seen = RecentKeys(maxsize, ttl)
+        self.duplicates = 0
+
+    async def __call__(self, handler, event, data):
+        callback = event.callback_query
+        fresh = self.seen.add(("update", event.update_id))
+        if callback is not None:
+            fresh = self.seen.add(("callback", callback.id)) and fresh
+        if fresh:
+            return await handler(event, data)
+        self.duplicates += 1
+        if callback is not None:
+            # Убираем "часики" на кнопке; если первый апдейт уже ответил, Telegram вернёт ошибку
+            try:
+                await callback.answer()
+            except TelegramBadRequest:
+                pass
+        return None
+
+
+# Корзины токенов по ключу (user id)
+class TokenBuckets:
+    """Корзина на ключ: rate токенов в секунду, не больше burst; наполнившиеся корзины забываются"""
+
+    def __init__(self, rate, burst, maxsize=100000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        # ключ -> [токены, когда пересчитаны, отказов подряд]; порядок - по времени пересчёта
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    # Трата токена
+    def hit(self, key):
+        """Тратит токен ключа; возвращает 0, если токен был, иначе сколько раз подряд токена не хватило"""
+        now = time.monotonic()
+        # Корзина, не тронутая burst / rate секунд, снова полна - такую можно не хранить
+        refill_time = self.burst / self.rate
+        while self._buckets:
+            oldest, bucket = next(iter(self._buckets.items()))
+            if bucket[1] + refill_time > now and len(self._buckets) < self.maxsize:
+                break
+            del self._buckets[oldest]
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = [self.burst, now, 0]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = 0
+        else:
+            bucket[2] += 1
+        self._buckets[key] = bucket
+        return bucket[2]
+
+
+# Защита от флуда
+class ThrottleMiddleware(BaseMiddleware):
+    """Ограничивает частоту нажатий кнопок и сообщений каждого пользователя; лишние не доходят до обработчиков"""
+
+    def __init__(self, callback_rate=2.0, callback_burst=5, text_rate=1.0, text_burst=5):
+        self.callbacks = TokenBuckets(callback_rate, callback_burst)
+        self.texts = TokenBuckets(text_rate, text_burst)
+        self.throttled = 0
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        if event.callback_query is not None:
+            denied = self.callbacks.hit(user.id)
+        elif event.message is not None:
+            denied = self.texts.hit(user.id)
+        else:
+            denied = 0
+        if not denied:
+            return await handler(event, data)
+        self.throttled += 1
+        # Нажатие кнопки нужно подтвердить всегда, о сообщениях предупреждаем один раз за серию
+        if event.callback_query is not None:
+            await event.callback_query.answer("Не так быстро! 🐢")
+        elif denied == 1:
+            await event.message.answer("Не так быстро! 🐢 Подождите немного.")
+        return None
+
+
+# Метрики апдейтов
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Замеряет время обработки апдейтов по типам и считает апдейты в работе (вместе с ожидающими очереди)"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.in_flight = 0
+        metrics.collect("updates_in_flight", lambda: self.in_flight,
+                        help="Апдейты, которые получены и ещё не обработаны")
+
+    async def __call__(self, handler, event, data):
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            self.metrics.observe("update_seconds", time.perf_counter() - started,
+                                 "Время обработки апдейта", type=event.event_type)
+
+
+# Метрики обработчиков
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Замеряет время работы каждого обработчика и открывает для него участок трассы
+    (ставится на dp.message, dp.callback_query и т.п.)"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            with tracing.span("handler", handler=name):
+                return await handler(event, data)
+        finally:
+            self.metrics.observe("handler_seconds", time.perf_counter() - started,
+                                 "Время работы обработчика", handler=name)
+
+
+# Трасса на каждый апдейт
+class TraceMiddleware(BaseMiddleware):
+    """Открывает корневой участок трассы на апдейт; медленные апдейты попадают в журнал со всеми участками"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        with tracing.trace("update", update_id=event.update_id, type=event.event_type,
+                           user_id=user.id if user else None):
+            return await handler(event, data)
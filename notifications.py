@@ -0,0 +1,122 @@
+import asyncio
+import heapq
+import logging
+import time
+
+from pet_store import DECAY_PER_HOUR, NEED_THRESHOLD, STATS
+
+logger = logging.getLogger(__name__)
+
+
+# Момент, когда питомцу впервые чего-то не хватит
+def next_need(store, row):
+    """Возвращает (время, характеристика), когда самая низкая характеристика опустится ниже порога, или None"""
+    # Все характеристики убывают с одной скоростью, поэтому первой порог пересечёт самая низкая
+    stat = min(STATS, key=lambda name: getattr(store, name)[row])
+    value = getattr(store, stat)[row]
+    if value < NEED_THRESHOLD:
+        return None
+    return store.updated[row] + (value - NEED_THRESHOLD) / DECAY_PER_HOUR * 3600, stat
+
+
+# Планировщик напоминаний о нуждах питомцев
+class NeedScheduler:
+    """Держит время следующего напоминания каждого питомца в одной куче и обслуживает её одной задачей"""
+
+    def __init__(self, store, notify, batch_size=30):
+        self.store = store
+        self.notify = notify
+        # Сколько напоминаний отправляется одновременно
+        self.batch_size = batch_size
+        self._heap = []
+        # user id -> действующая запись в куче; записи, которых здесь нет, устарели
+        self._live = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._live)
+
+    # Планирование напоминания для питомца
+    def schedule(self, user_id):
+        """Пересчитывает время напоминания после изменения характеристик питомца"""
+        user_id = int(user_id)
+        row = self.store.row(user_id)
+        need = next_need(self.store, row) if row is not None else None
+        if need is None:
+            self._live.pop(user_id, None)
+            return
+        entry = (need[0], user_id, need[1])
+        self._live[user_id] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+        # Устаревшие записи выбрасываются при извлечении; если их слишком много - пересобираем кучу
+        if len(self._heap) > 2 * len(self._live) + 1024:
+            self._heap = list(self._live.values())
+            heapq.heapify(self._heap)
+
+    # Отмена напоминаний
+    def cancel(self, user_id):
+        """Отменяет напоминание (например, когда питомца удалили)"""
+        self._live.pop(int(user_id), None)
+
+    # Планирование напоминаний для всех питомцев
+    def schedule_all(self):
+        """Заполняет кучу для всех питомцев хранилища (при запуске); порог, пересечённый до запуска, не напоминается,
+        иначе каждый перезапуск заново напоминал бы всем заброшенным питомцам"""
+        self._live = {}
+        now = time.time()
+        for user_id_str in self.store:
+            user_id = int(user_id_str)
+            need = next_need(self.store, self.store.row(user_id))
+            if need is not None and need[0] > now:
+                self._live[user_id] = (need[0], user_id, need[1])
+        self._heap = list(self._live.values())
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            # Подошедшие напоминания отправляются пачками не больше batch_size, а не отдельной задачей каждое
+            now = time.time()
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                entry = heapq.heappop(self._heap)
+                user_id = entry[1]
+                if self._live.get(user_id) is not entry:
+                    continue
+                del self._live[user_id]
+                batch.append(self._send(user_id, entry[2]))
+            if batch:
+                await asyncio.gather(*batch)
+                continue
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, user_id, stat):
+        try:
+            await self.notify(user_id, stat)
+        except Exception:
+            logger.exception("Не удалось отправить напоминание пользователю %s", user_id)
+
+    # Запуск планировщика
+    def start(self):
+        """Запускает фоновую задачу, отправляющую напоминания в срок"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # Остановка планировщика
+    async def close(self):
+        """Останавливает фоновую задачу"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,159 @@
+from array import array
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Типы питомцев и их коды в хранилище
+PET_TYPES = ('cat', 'dog', 'parrot')
+PET_TYPE_CODES = {pet_type: code for code, pet_type in enumerate(PET_TYPES)}
+# Характеристики питомца и скорость их убывания (очков в час)
+STATS = ('hunger', 'mood', 'energy')
+DECAY_PER_HOUR = 2
+# Ниже этого значения питомцу чего-то не хватает (как в статусе питомца)
+NEED_THRESHOLD = 20
+
+
+# Время последнего обновления из записи на диске
+def parse_timestamp(value):
+    """Переводит время из записи (секунды или старый ISO формат) в секунды эпохи"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+# Колоночное хранилище питомцев
+class PetStore:
+    """Хранит питомцев по столбцам в массивах фиксированной ширины; user id -> номер строки"""
+
+    def __init__(self):
+        self._rows = {}
+        self._free = []
+        self.user_ids = array('q')
+        self.alive = array('B')
+        self.types = array('B')
+        self.hunger = array('f')
+        self.mood = array('f')
+        self.energy = array('f')
+        self.updated = array('d')
+        self.names = []
+
+    # Создание хранилища из записей на диске
+    @classmethod
+    def from_records(cls, records):
+        """Строит хранилище из словаря {user id: запись}; ключи, не похожие на user id, пропускаются"""
+        store = cls()
+        for key, record in records.items():
+            if not key.isdigit():
+                continue
+            store.put(key, record['name'], record['type'], record['hunger'], record['mood'],
+                      record['energy'], parse_timestamp(record['last_update']))
+        return store
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return (str(user_id) for user_id in self._rows)
+
+    def __contains__(self, user_id):
+        return self.row(user_id) is not None
+
+    # Номер строки питомца
+    def row(self, user_id):
+        """Возвращает номер строки питомца или None"""
+        try:
+            return self._rows.get(int(user_id))
+        except ValueError:
+            return None
+
+    # Добавление или обновление питомца
+    def put(self, user_id, name, pet_type, hunger, mood, energy, updated):
+        """Записывает питомца в его строку (новому питомцу отдаётся свободная или новая строка)"""
+        user_id = int(user_id)
+        row = self._rows.get(user_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self.names)
+                self.user_ids.append(0)
+                self.alive.append(0)
+                self.types.append(0)
+                self.hunger.append(0)
+                self.mood.append(0)
+                self.energy.append(0)
+                self.updated.append(0)
+                self.names.append(None)
+            self._rows[user_id] = row
+        self.user_ids[row] = user_id
+        self.alive[row] = 1
+        self.types[row] = PET_TYPE_CODES.get(pet_type, 0)
+        self.hunger[row] = hunger
+        self.mood[row] = mood
+        self.energy[row] = energy
+        self.updated[row] = updated
+        self.names[row] = name
+
+    # Запись питомца для сохранения
+    def get(self, user_id, default=None):
+        """Возвращает питомца в виде словаря (формат записи на диске) или default"""
+        row = self.row(user_id)
+        if row is None:
+            return default
+        return {
+            'name': self.names[row],
+            'type': PET_TYPES[self.types[row]],
+            'hunger': round(self.hunger[row], 3),
+            'mood': round(self.mood[row], 3),
+            'energy': round(self.energy[row], 3),
+            'last_update': self.updated[row]
+        }
+
+    def __delitem__(self, user_id):
+        row = self._rows.pop(int(user_id))
+        self.alive[row] = 0
+        self.names[row] = None
+        self._free.append(row)
+
+    # Характеристики всех питомцев на момент now
+    def current_stats(self, now):
+        """Применяет убывание ко всем строкам сразу; возвращает {характеристика: массив по строкам}"""
+        if np is None:
+            decrease = [max(0.0, (now - updated) / 3600 * DECAY_PER_HOUR) for updated in self.updated]
+            return {stat: [max(0.0, value - d) for value, d in zip(getattr(self, stat), decrease)]
+                    for stat in STATS}
+        # Представления numpy над массивами без копирования; их нельзя держать дольше вызова,
+        # иначе array не сможет расти
+        updated = np.frombuffer(self.updated, dtype=np.float64)
+        decrease = np.maximum((now - updated) * (DECAY_PER_HOUR / 3600), 0.0).astype(np.float32)
+        stats = {}
+        for stat in STATS:
+            values = np.frombuffer(getattr(self, stat), dtype=np.float32)
+            stats[stat] = np.maximum(values - decrease, 0.0)
+            del values
+        del updated
+        return stats
+
+    # Поиск питомцев, которым чего-то не хватает
+    def find_needs(self, now, threshold=NEED_THRESHOLD):
+        """Возвращает {характеристика: user id живых питомцев, у которых она ниже порога}"""
+        if np is None:
+            stats = self.current_stats(now)
+            return {stat: [self.user_ids[row] for row, value in enumerate(values)
+                           if self.alive[row] and value < threshold]
+                    for stat, values in stats.items()}
+        # value - decrease < threshold  <=>  value < threshold + decrease: обходимся без промежуточных массивов
+        updated = np.frombuffer(self.updated, dtype=np.float64)
+        limit = (np.maximum((now - updated) * (DECAY_PER_HOUR / 3600), 0.0) + threshold).astype(np.float32)
+        alive = np.frombuffer(self.alive, dtype=np.bool_)
+        user_ids = np.frombuffer(self.user_ids, dtype=np.int64)
+        needs = {}
+        for stat in STATS:
+            values = np.frombuffer(getattr(self, stat), dtype=np.float32)
+            needs[stat] = user_ids[alive & (values < limit)]
+            del values
+        del updated, alive, user_ids
+        return needs
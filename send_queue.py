@@ -0,0 +1,117 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты отправки: ответы пользователю раньше фоновых рассылок
+INTERACTIVE = 0
+BACKGROUND = 1
+send_priority = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+
+# Пометка фоновой отправки
+def mark_background():
+    """Помечает отправки текущей задачи как фоновые (напоминания и рассылки)"""
+    send_priority.set(BACKGROUND)
+
+
+# Очередь исходящих сообщений с учётом лимитов Telegram
+class SendQueue(BaseRequestMiddleware):
+    """Пропускает запросы с chat_id не чаще лимитов (общего и на чат), учитывает retry_after при 429"""
+
+    def __init__(self, global_rate=30.0, chat_rate=1.0, chat_burst=3, max_retries=3):
+        self.global_interval = 1.0 / global_rate
+        self.chat_interval = 1.0 / chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        # chat id -> момент, с которого у чата снова есть свободный слот
+        self._chat_free_at = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self.sent = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        priority = send_priority.get()
+        with span("telegram_send", method=type(method).__name__):
+            for attempt in range(self.max_retries + 1):
+                with span("send_wait"):
+                    await self._acquire(chat_id, priority)
+                try:
+                    with span("telegram_request"):
+                        return await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.retries += 1
+                    logger.warning("Telegram просит подождать %s с (чат %s)", e.retry_after, chat_id)
+                    resume_at = time.monotonic() + e.retry_after
+                    self._paused_until = max(self._paused_until, resume_at)
+                    self._chat_free_at[chat_id] = max(self._chat_free_at.get(chat_id, 0.0), resume_at)
+
+    async def _acquire(self, chat_id, priority):
+        started = time.monotonic()
+        # Слот чата: не чаще chat_rate в секунду, с небольшим запасом на всплески
+        free_at = max(self._chat_free_at.get(chat_id, 0.0), started - self.chat_burst * self.chat_interval)
+        self._chat_free_at[chat_id] = free_at + self.chat_interval
+        if free_at > started:
+            await asyncio.sleep(free_at - started)
+        if len(self._chat_free_at) > 10000:
+            now = time.monotonic()
+            self._chat_free_at = {chat: t for chat, t in self._chat_free_at.items() if t > now}
+        # Общий слот выдаёт одна задача-диспетчер в порядке приоритета
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+        await future
+        waited = time.monotonic() - started
+        self.sent += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def _dispatch(self):
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = max(self._next_slot, self._paused_until) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            future.set_result(None)
+            self._next_slot = time.monotonic() + self.global_interval
+
+    # Состояние очереди
+    def stats(self):
+        """Возвращает глубину очереди и время ожидания отправки"""
+        return {
+            'queue_depth': len(self._waiters),
+            'sent': self.sent,
+            'retries': self.retries,
+            'avg_wait': self.total_wait / self.sent if self.sent else 0.0,
+            'max_wait': self.max_wait
+        }
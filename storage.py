@@ -0,0 +1,401 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from tracing import span, trace
+
+logger = logging.getLogger(__name__)
+
+# Количество файлов-шардов по умолчанию
+DEFAULT_SHARD_COUNT = 256
+# Размер журнала (в байтах), после которого он сворачивается в шарды
+DEFAULT_COMPACT_THRESHOLD = 4 * 1024 * 1024
+
+
+# Шардированное хранилище записей в JSON файлах с журналом изменений
+class ShardedJsonStore:
+    """Хранит снимок по шардам (один JSON файл на корзину user id), а изменения дописывает в журнал"""
+
+    def __init__(self, directory, legacy_file=None, shard_count=DEFAULT_SHARD_COUNT,
+                 compact_threshold=DEFAULT_COMPACT_THRESHOLD):
+        self.directory = directory
+        self.legacy_file = legacy_file
+        self.shard_count = shard_count
+        self.compact_threshold = compact_threshold
+        self._log = None
+        self._log_seq = 0
+        self._log_size = 0
+        self._pending = {}
+        self._compactor = None
+        # Байты, записанные в журнал и шарды
+        self.bytes_written = 0
+
+    # Номер шарда для ключа
+    def shard_of(self, key):
+        """Возвращает номер шарда, в котором лежит ключ"""
+        return zlib.crc32(str(key).encode('utf-8')) % self.shard_count
+
+    def _shard_path(self, shard):
+        return os.path.join(self.directory, f"shard_{shard:04d}.json")
+
+    def _log_path(self, seq):
+        return os.path.join(self.directory, f"wal_{seq:06d}.jsonl")
+
+    def _log_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith("wal_") and name.endswith(".jsonl"):
+                segments.append(int(name[4:-6]))
+        return sorted(segments)
+
+    # Открытие хранилища
+    def open(self):
+        """Сворачивает оставшийся журнал в шарды и начинает новый (при первом запуске переносит старый файл)"""
+        if self._log is not None:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+            data = self._load_legacy()
+            if data:
+                self._write_shards({key: json.dumps(value, ensure_ascii=False)
+                                    for key, value in data.items()})
+            self._open_log(1)
+            return
+        segments = self._log_segments()
+        changes = {}
+        for seq in segments:
+            changes.update(self._read_log(self._log_path(seq)))
+        if changes:
+            self._write_shards(changes)
+        for seq in segments:
+            os.remove(self._log_path(seq))
+        self._open_log((segments[-1] + 1) if segments else 1)
+
+    # Загрузка всех записей
+    def load(self):
+        """Открывает хранилище и загружает все записи из шардов"""
+        if self._log is None:
+            self.open()
+        else:
+            self.compact(wait=True)
+        data = {}
+        for name in os.listdir(self.directory):
+            if not (name.startswith("shard_") and name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    data.update(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return data
+
+    def _load_legacy(self):
+        if self.legacy_file and os.path.exists(self.legacy_file):
+            try:
+                with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return {}
+        return {}
+
+    def _read_log(self, path):
+        changes = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Недописанная строка после аварийной остановки
+                    continue
+                changes[entry['k']] = entry.get('v')
+        return changes
+
+    def _open_log(self, seq):
+        self._log_seq = seq
+        self._log = open(self._log_path(seq), 'a', encoding='utf-8')
+        self._log_size = self._log.tell()
+
+    # Запись изменений в журнал
+    def save(self, data, keys=None):
+        """Дописывает в журнал текущие значения указанных ключей (без ключей - всех ключей)"""
+        if keys is None:
+            keys = list(data)
+        lines = []
+        with span("json_dump", records=len(keys)):
+            for key in keys:
+                key = str(key)
+                if key in data:
+                    value = json.dumps(data[key], ensure_ascii=False)
+                    lines.append(json.dumps({'k': key, 'v': value}, ensure_ascii=False))
+                else:
+                    value = None
+                    lines.append(json.dumps({'k': key}, ensure_ascii=False))
+                self._pending[key] = value
+        chunk = "\n".join(lines) + "\n"
+        self._log.write(chunk)
+        self._log.flush()
+        self._log_size += len(chunk)
+        self.bytes_written += len(chunk.encode('utf-8'))
+        if self._log_size >= self.compact_threshold:
+            self.compact()
+
+    # Сворачивание журнала в шарды
+    def compact(self, wait=False):
+        """Начинает новый журнал и в фоне переносит изменения из старого в шарды"""
+        if self._compactor is not None and self._compactor.is_alive():
+            if not wait:
+                return
+            self._compactor.join()
+        if not self._pending:
+            return
+        changes, self._pending = self._pending, {}
+        old_seq = self._log_seq
+        self._log.close()
+        self._open_log(old_seq + 1)
+        self._compactor = threading.Thread(
+            target=self._fold, args=(changes, old_seq), name="wal-compactor", daemon=True)
+        self._compactor.start()
+        if wait:
+            self._compactor.join()
+
+    def _fold(self, changes, seq):
+        self._write_shards(changes)
+        os.remove(self._log_path(seq))
+
+    def _write_shards(self, changes):
+        by_shard = {}
+        for key, value in changes.items():
+            by_shard.setdefault(self.shard_of(key), {})[key] = value
+        for shard, shard_changes in by_shard.items():
+            path = self._shard_path(shard)
+            records = {}
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+            for key, value in shard_changes.items():
+                if value is None:
+                    records.pop(key, None)
+                else:
+                    records[key] = json.loads(value)
+            if not records:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(records, f, ensure_ascii=False)
+            self.bytes_written += os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+
+    # Закрытие хранилища
+    def close(self):
+        """Сворачивает журнал и закрывает файл"""
+        self.compact(wait=True)
+        if self._compactor is not None:
+            self._compactor.join()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+# Общий интерфейс хранилища
+class Storage:
+    """Хранилище записей по пространствам имён (питомцы, игры в города), ключ - user id"""
+
+    # Сколько байт записано на диск с момента открытия
+    bytes_written = 0
+
+    def load(self, namespace):
+        """Возвращает все записи пространства имён"""
+        raise NotImplementedError
+
+    def write(self, namespace, changes):
+        """Сохраняет изменения {ключ: запись}; запись None удаляет ключ"""
+        raise NotImplementedError
+
+    def close(self):
+        """Сохраняет всё несохранённое и освобождает ресурсы"""
+
+
+# JSON хранилище: шарды + журнал на каждое пространство имён
+class JsonStorage(Storage):
+    """Хранит каждое пространство имён в своём ShardedJsonStore"""
+
+    def __init__(self, directories, legacy_files=None):
+        legacy_files = legacy_files or {}
+        self._stores = {
+            namespace: ShardedJsonStore(directory, legacy_file=legacy_files.get(namespace))
+            for namespace, directory in directories.items()
+        }
+
+    def load(self, namespace):
+        # Загруженные записи отдаём целиком и не держим копию: ими владеет вызывающий
+        with span("json_load", namespace=namespace):
+            return self._stores[namespace].load()
+
+    def write(self, namespace, changes):
+        store = self._stores[namespace]
+        store.open()
+        changes = {str(key): value for key, value in changes.items()}
+        store.save({key: value for key, value in changes.items() if value is not None}, list(changes))
+
+    @property
+    def bytes_written(self):
+        return sum(store.bytes_written for store in self._stores.values())
+
+    def close(self):
+        for store in self._stores.values():
+            store.close()
+
+
+# SQLite хранилище
+class SqliteStorage(Storage):
+    """Хранит записи в SQLite (WAL режим, одно долгоживущее соединение, таблица на пространство имён)"""
+
+    def __init__(self, path, namespaces):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Заранее готовим запросы для каждой таблицы; sqlite3 кэширует их подготовленные версии
+        self._sql = {}
+        for namespace in namespaces:
+            if not namespace.isidentifier():
+                raise ValueError(f"Недопустимое имя таблицы: {namespace}")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {namespace} "
+                f"(user_id TEXT PRIMARY KEY, data TEXT NOT NULL) WITHOUT ROWID"
+            )
+            self._sql[namespace] = {
+                'all': f"SELECT user_id, data FROM {namespace}",
+                'put': (f"INSERT INTO {namespace} (user_id, data) VALUES (?, ?) "
+                        f"ON CONFLICT(user_id) DO UPDATE SET data = excluded.data"),
+                'delete': f"DELETE FROM {namespace} WHERE user_id = ?",
+            }
+
+    def load(self, namespace):
+        with span("json_load", namespace=namespace):
+            rows = self._conn.execute(self._sql[namespace]['all'])
+            return {user_id: json.loads(data) for user_id, data in rows}
+
+    def write(self, namespace, changes):
+        sql = self._sql[namespace]
+        puts = []
+        deletes = []
+        with span("json_dump", records=len(changes)):
+            for key, value in changes.items():
+                if value is None:
+                    deletes.append((str(key),))
+                else:
+                    data = json.dumps(value, ensure_ascii=False)
+                    puts.append((str(key), data))
+                    self.bytes_written += len(data.encode('utf-8'))
+        with span("sqlite_write", namespace=namespace), self._conn:
+            self._conn.execute("BEGIN")
+            if puts:
+                self._conn.executemany(sql['put'], puts)
+            if deletes:
+                self._conn.executemany(sql['delete'], deletes)
+
+    def close(self):
+        self._conn.close()
+
+
+# Отложенная запись изменений вне цикла событий
+class WriteBehind:
+    """Копит отметки об изменённых записях и раз в interval секунд сохраняет их одной пачкой в отдельном потоке"""
+
+    def __init__(self, storage, interval=0.5, snapshots=None):
+        self.storage = storage
+        self.interval = interval
+        # Пространство имён -> функция, делающая из записи в памяти копию для записи на диск
+        self.snapshots = snapshots or {}
+        self._pending = {}
+        self._task = None
+        # Записи идут по одной: два storage.write одновременно ломают транзакцию SQLite и файл журнала JSON
+        self._flush_lock = asyncio.Lock()
+        self._closing = asyncio.Event()
+        self.flushes = 0
+        self.records_written = 0
+        self.flush_seconds = 0.0
+
+    # Отметка изменённой записи
+    def mark(self, namespace, key, record):
+        """Запоминает актуальную запись (None - удаление); повторные отметки одного ключа склеиваются"""
+        self._pending.setdefault(namespace, {})[str(key)] = record
+
+    # Сохранение накопленных изменений
+    async def flush(self):
+        """Сохраняет все накопленные изменения; если запись уже идёт, дожидается её"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            dirty, self._pending = self._pending, {}
+            with trace("flush", records=sum(len(changes) for changes in dirty.values())):
+                await self._flush_batch(dirty)
+
+    async def _flush_batch(self, dirty):
+        # Снимок делаем в цикле событий: дальше обработчики могут менять записи, пока поток пишет
+        with span("snapshot"):
+            batch = {
+                namespace: {key: self.snapshots.get(namespace, copy.deepcopy)(record)
+                            for key, record in changes.items()}
+                for namespace, changes in dirty.items()
+            }
+        started = time.perf_counter()
+        try:
+            # Поток получает копию контекста, поэтому участки из него попадают в трассу записи
+            await asyncio.to_thread(self._write_batch, batch)
+            self.flushes += 1
+            self.records_written += sum(len(changes) for changes in batch.values())
+            self.flush_seconds += time.perf_counter() - started
+        except Exception:
+            logger.exception("Не удалось сохранить данные, повторим при следующей записи")
+            for namespace, changes in dirty.items():
+                retry = dict(changes)
+                retry.update(self._pending.get(namespace, {}))
+                self._pending[namespace] = retry
+
+    def _write_batch(self, batch):
+        for namespace, changes in batch.items():
+            self.storage.write(namespace, changes)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.interval)
+                return
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    # Запуск фоновой записи
+    def start(self):
+        """Запускает фоновую задачу, сохраняющую изменения раз в interval секунд"""
+        if self._task is None:
+            self._closing.clear()
+            self._task = asyncio.create_task(self._run())
+
+    # Остановка фоновой записи
+    async def close(self):
+        """Останавливает фоновую задачу и сохраняет оставшиеся изменения"""
+        # Задачу не отменяем: отмена посреди записи в потоке оставила бы её идти параллельно с последней
+        if self._task is not None:
+            self._closing.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+# Перенос данных между хранилищами
+def migrate(source, target, namespaces):
+    """Копирует все записи указанных пространств имён из одного хранилища в другое"""
+    for namespace in namespaces:
+        records = source.load(namespace)
+        if records:
+            target.write(namespace, records)
@@ -0,0 +1,167 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Текущий участок трассы; None - трассы нет и участки ничего не делают
+_current = contextvars.ContextVar("trace_span", default=None)
+# Журнал медленных трасс (настраивается через configure)
+_slow_log_path = None
+_slow_threshold = 0.5
+_max_bytes = 0
+# Участки, время которых не считается при проверке на медленность (ожидание очереди отправки)
+_exclude = ()
+# Строки журнала пишет отдельный поток, чтобы файл не открывался в цикле событий
+_lines = queue.SimpleQueue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+# Настройка журнала медленных трасс
+def configure(path, threshold_ms=500, max_bytes=10 * 1024 * 1024, exclude=("send_wait",)):
+    """Включает трассировку: трассы дольше threshold_ms миллисекунд (без участков из exclude) дописываются
+    в JSONL файл path; файл больше max_bytes переименовывается в path.1 (0 - без ротации)"""
+    global _slow_log_path, _slow_threshold, _max_bytes, _exclude
+    _slow_log_path = path
+    _slow_threshold = threshold_ms / 1000
+    _max_bytes = max_bytes
+    _exclude = tuple(exclude)
+
+
+# Участок трассы
+class Span:
+    """Имя, атрибуты, время начала и длительность участка и вложенные участки"""
+
+    __slots__ = ("name", "attrs", "start", "duration", "children", "_token")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.duration = None
+        self.children = []
+        self._token = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        return False
+
+    def to_dict(self, origin):
+        record = {'name': self.name, 'at_ms': round((self.start - origin) * 1000, 3)}
+        record['ms'] = round(self.duration * 1000, 3) if self.duration is not None else None
+        record.update(self.attrs)
+        if self.children:
+            record['children'] = [child.to_dict(origin) for child in self.children]
+        return record
+
+
+# Корневой участок: по завершении медленная трасса пишется в журнал
+class _Trace(Span):
+    __slots__ = ()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        excluded = _excluded_time(self)
+        if self.duration - excluded >= _slow_threshold:
+            _write_slow(self, excluded)
+        return False
+
+
+# Пустой участок для кода вне трассы
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _excluded_time(parent):
+    total = 0.0
+    for child in parent.children:
+        if child.name in _exclude:
+            total += child.duration or 0.0
+        else:
+            total += _excluded_time(child)
+    return total
+
+
+def _write_slow(root, excluded):
+    global _writer
+    record = {'time': time.time(), **root.to_dict(root.start)}
+    if excluded:
+        record['excluded_ms'] = round(excluded * 1000, 3)
+    _lines.put(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_lines, name="slow-trace-writer", daemon=True)
+            _writer.start()
+
+
+def _write_lines():
+    while True:
+        lines = [_lines.get()]
+        # Всё, что накопилось, дописывается за одно открытие файла
+        while not _lines.empty():
+            lines.append(_lines.get())
+        stop = None in lines
+        lines = [line for line in lines if line is not None]
+        try:
+            if _max_bytes and os.path.exists(_slow_log_path) and os.path.getsize(_slow_log_path) >= _max_bytes:
+                os.replace(_slow_log_path, _slow_log_path + ".1")
+            if lines:
+                with open(_slow_log_path, 'a', encoding='utf-8') as f:
+                    f.writelines(lines)
+        except OSError:
+            logger.exception("Не удалось записать медленные трассы в %s", _slow_log_path)
+        if stop:
+            return
+
+
+# Остановка записи журнала
+def close():
+    """Дописывает накопленные медленные трассы и останавливает поток записи"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        _lines.put(None)
+        writer.join()
+
+
+# Начало трассы
+def trace(name, **attrs):
+    """Открывает трассу (апдейт, фоновая запись); без configure ничего не делает"""
+    if _slow_log_path is None:
+        return _NULL_SPAN
+    return _Trace(name, attrs)
+
+
+# Вложенный участок
+def span(name, **attrs):
+    """Открывает участок внутри текущей трассы; вне трассы ничего не делает"""
+    parent = _current.get()
+    if parent is None:
+        return _NULL_SPAN
+    child = Span(name, attrs)
+    parent.children.append(child)
+    return child
+